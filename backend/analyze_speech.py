@@ -11,19 +11,50 @@ import numpy as np
 import json
 import sys
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
-from difflib import SequenceMatcher
 from scipy.signal import butter, filtfilt
 from scipy.stats import kurtosis
+from reference_index import build_reference_entry, get_reference, remember_reference
+from inference_tuning import inference_context
+from audio_container import (
+    EXTENSION as CONTAINER_EXTENSION,
+    decode_container,
+    read_container,
+)
+
+# Bump whenever a change alters analysis results (invalidates cached results)
+PIPELINE_VERSION = "4"
+
+# wav2vec2 emits one frame per 320 input samples
+FRAME_STRIDE = 320
 
 
 def load_audio(audio_path, target_sr=16000):
-    """Load audio file and resample to target sample rate."""
+    """
+    Load audio and resample to target sample rate.
+
+    ``audio_path`` may also be an audio container (a ``.phnv`` path or the
+    container bytes); containers already at ``target_sr`` skip resampling.
+    """
     import logging
 
     logger = logging.getLogger(__name__)
 
-    logger.info(f"Loading audio from: {audio_path}")
-    audio, sr = librosa.load(audio_path, sr=target_sr)
+    if isinstance(audio_path, (bytes, bytearray, memoryview)):
+        logger.info(f"Decoding audio container: {len(audio_path)} bytes")
+        audio, sr = decode_container(audio_path)
+        audio_path = "<audio container>"
+    elif audio_path.endswith(CONTAINER_EXTENSION):
+        logger.info(f"Memory-mapping audio container: {audio_path}")
+        audio, sr = read_container(audio_path)
+    else:
+        logger.info(f"Loading audio from: {audio_path}")
+        audio, sr = librosa.load(audio_path, sr=target_sr)
+
+    if sr != target_sr:
+        logger.info(f"Resampling container audio from {sr}Hz to {target_sr}Hz")
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=target_sr)
+        sr = target_sr
+
     logger.info(f"Loaded audio: {len(audio)} samples, duration: {len(audio)/sr:.2f}s")
 
     if len(audio) == 0:
@@ -37,8 +68,8 @@ def get_transcription(audio, processor, model, device):
     inputs = processor(audio, sampling_rate=16000, return_tensors="pt", padding=True)
     input_values = inputs.input_values.to(device)
 
-    with torch.no_grad():
-        logits = model(input_values).logits
+    with torch.no_grad(), inference_context():
+        logits = model(input_values).logits.float()
 
     predicted_ids = torch.argmax(logits, dim=-1)
     transcription = processor.batch_decode(predicted_ids)[0]
@@ -46,29 +77,148 @@ def get_transcription(audio, processor, model, device):
     return transcription, logits
 
 
-def find_sibilant_regions(audio, logits, processor, sr=16000):
-    """Find /s/ sound regions in audio using phoneme detection."""
-    predicted_ids = torch.argmax(logits, dim=-1)[0]
-    tokens = [processor.tokenizer.decode([id.item()]) for id in predicted_ids]
+def ctc_forced_align(log_probs, targets, blank=0, input_lengths=None, target_lengths=None):
+    """
+    Viterbi-align known target sequences to CTC log-probabilities.
+
+    Runs over a whole batch at once: the only Python loop is over frames,
+    every step is vectorized across utterances and alignment states.
 
-    regions = []
-    current_region = None
-    frame_duration = 320 / sr  # wav2vec2 stride
+    Args:
+        log_probs: (batch, frames, vocab) or (frames, vocab) log-probabilities
+        targets: (batch, max_targets) padded target ids, or one id sequence
+        blank: CTC blank token id
+        input_lengths: Valid frames per utterance (default: all frames)
+        target_lengths: Valid targets per utterance (default: all targets)
 
-    for i, token in enumerate(tokens):
-        token_clean = token.strip().lower()
-        is_s = "s" in token_clean
+    Returns:
+        Tuple of (alignment, frame_log_probs), both (batch, frames):
+        the target index emitted at each frame (-1 for blank or padding)
+        and the log-probability of the label chosen at that frame
+    """
+    log_probs = torch.as_tensor(log_probs, dtype=torch.float32)
+    targets = torch.as_tensor(targets, dtype=torch.long, device=log_probs.device)
+    if log_probs.dim() == 2:
+        log_probs = log_probs.unsqueeze(0)
+        targets = targets.unsqueeze(0)
+
+    batch, num_frames, _ = log_probs.shape
+    device = log_probs.device
+    if input_lengths is None:
+        input_lengths = torch.full((batch,), num_frames, dtype=torch.long)
+    if target_lengths is None:
+        target_lengths = torch.full((batch,), targets.shape[1], dtype=torch.long)
+    input_lengths = torch.as_tensor(input_lengths, dtype=torch.long, device=device)
+    target_lengths = torch.as_tensor(target_lengths, dtype=torch.long, device=device)
+
+    # Interleave blanks: blank, t0, blank, t1, ..., blank
+    num_states = 2 * targets.shape[1] + 1
+    states = torch.full((batch, num_states), blank, dtype=torch.long, device=device)
+    states[:, 1::2] = targets
+
+    # A label may skip the preceding blank unless it repeats the label before it
+    can_skip = torch.zeros((batch, num_states), dtype=torch.bool, device=device)
+    can_skip[:, 3::2] = states[:, 3::2] != states[:, 1:-2:2]
+
+    repeats = (~can_skip[:, 3::2]) & (
+        torch.arange(1, targets.shape[1], device=device) < target_lengths[:, None]
+    )
+    min_frames = target_lengths + repeats.sum(dim=1)
+    if bool((input_lengths < min_frames).any()):
+        raise ValueError("Audio too short to align against its target text")
+
+    emissions = log_probs.gather(2, states.unsqueeze(1).expand(-1, num_frames, -1))
+
+    neg_inf = torch.tensor(float("-inf"), device=device)
+    scores = torch.full((batch, num_states), float("-inf"), device=device)
+    scores[:, 0] = emissions[:, 0, 0]
+    if num_states > 1:
+        scores[:, 1] = emissions[:, 0, 1]
+    backpointers = torch.zeros(
+        (batch, num_frames, num_states), dtype=torch.long, device=device
+    )
 
-        if is_s:
-            if current_region is None:
-                current_region = i
-        else:
-            if current_region is not None:
-                regions.append((current_region * frame_duration, i * frame_duration))
-                current_region = None
+    pad1 = torch.full((batch, 1), float("-inf"), device=device)
+    pad2 = torch.full((batch, 2), float("-inf"), device=device)
+    for t in range(1, num_frames):
+        step = torch.cat([pad1, scores[:, :-1]], dim=1)
+        skip = torch.where(can_skip, torch.cat([pad2, scores[:, :-2]], dim=1), neg_inf)
+        best, choice = torch.stack([scores, step, skip]).max(dim=0)
+
+        # Frames past an utterance's end keep its scores frozen
+        active = (t < input_lengths)[:, None]
+        scores = torch.where(active, best + emissions[:, t], scores)
+        backpointers[:, t] = torch.where(active, choice, torch.zeros_like(choice))
+
+    # Each path must end on its last label or the trailing blank
+    rows = torch.arange(batch, device=device)
+    last_blank = 2 * target_lengths
+    last_label = (last_blank - 1).clamp(min=0)
+    state = torch.where(
+        scores[rows, last_label] > scores[rows, last_blank], last_label, last_blank
+    )
+
+    path = torch.empty((batch, num_frames), dtype=torch.long, device=device)
+    for t in range(num_frames - 1, -1, -1):
+        path[:, t] = state
+        state = state - backpointers[rows, t, state]
+
+    valid = torch.arange(num_frames, device=device)[None, :] < input_lengths[:, None]
+    alignment = torch.where((path % 2 == 1) & valid, path // 2, -1)
+    frame_log_probs = emissions.gather(2, path.unsqueeze(2)).squeeze(2)
+    frame_log_probs = torch.where(valid, frame_log_probs, neg_inf)
+
+    return alignment, frame_log_probs
+
+
+def find_sibilant_regions(alignment, frame_log_probs, s_spans, sr=16000):
+    """
+    Find /s/ regions in one utterance from its forced alignment.
 
-    if current_region is not None:
-        regions.append((current_region * frame_duration, len(tokens) * frame_duration))
+    CTC emits each label on one or two peaky frames and fills the rest with
+    blanks, so every /s/ also claims half of the blank run on each side,
+    stopping at the neighbouring labels.
+
+    Args:
+        alignment: (frames,) target index per frame from ctc_forced_align
+        frame_log_probs: (frames,) log-probability of the aligned label
+        s_spans: (first, last) target indices of each /s/ occurrence
+        sr: Sample rate of the aligned audio
+
+    Returns:
+        list: {"start", "end", "confidence"} per /s/ occurrence, times in
+        seconds; confidence is the mean posterior of the /s/ label frames
+    """
+    alignment = torch.as_tensor(alignment)
+    frame_log_probs = torch.as_tensor(frame_log_probs)
+    frame_duration = FRAME_STRIDE / sr
+
+    label_frames = torch.nonzero(alignment >= 0).squeeze(1)
+    labels = alignment[label_frames]
+    valid_frames = int(torch.isfinite(frame_log_probs).sum())
+
+    regions = []
+    for first, last in s_spans:
+        in_span = (labels >= first) & (labels <= last)
+        frames = label_frames[in_span]
+
+        before = label_frames[labels < first]
+        after = label_frames[labels > last]
+        start = frames[0].item()
+        end = frames[-1].item() + 1
+        prev_end = before[-1].item() + 1 if len(before) else 0
+        next_start = after[0].item() if len(after) else valid_frames
+
+        start = (prev_end + start) // 2
+        end = (end + next_start) // 2
+
+        regions.append(
+            {
+                "start": start * frame_duration,
+                "end": end * frame_duration,
+                "confidence": frame_log_probs[frames].exp().mean().item(),
+            }
+        )
 
     return regions
 
@@ -77,6 +227,13 @@ def extract_acoustic_features(audio, sr, start_time, end_time):
     """Extract acoustic features for lisp classification."""
     start_sample = int(start_time * sr)
     end_sample = int(end_time * sr)
+
+    # Widen segments shorter than one analysis window around their centre
+    if end_sample - start_sample < 512:
+        center = (start_sample + end_sample) // 2
+        start_sample = max(0, center - 256)
+        end_sample = start_sample + 512
+
     segment = audio[start_sample:end_sample]
 
     if len(segment) < 512:
@@ -137,32 +294,94 @@ def classify_acoustic_lisp(features):
     return "normal"
 
 
-def detect_phoneme_substitutions(truth_transcription, rec_transcription):
-    """Detect /s/ substitutions by comparing transcriptions."""
-    truth_words = truth_transcription.split()
-    rec_words = rec_transcription.split()
+def alignable_prefix(targets, num_frames):
+    """
+    Number of leading targets CTC can emit within ``num_frames`` frames.
+
+    Each target needs one frame, plus a blank frame when it repeats the
+    previous target.
+    """
+    needed = 0
+    for i, target in enumerate(targets):
+        needed += 2 if i > 0 and target == targets[i - 1] else 1
+        if needed > num_frames:
+            return i
+    return len(targets)
+
+
+def score_sibilants(audio, sr, logits, reference, blank=0):
+    """
+    Score every /s/ in a recording against a reference entry.
+
+    Each /s/ is located by forcing the reference targets onto the recording's
+    logits; occurrences whose features fall inside the reference's expected
+    range count as normal, the rest are classified by classify_acoustic_lisp.
+
+    A recording too short for the whole phrase (e.g. the speaker stopped
+    early) is aligned against the part of the phrase that fits and only the
+    /s/ sounds in that part are scored.
 
-    matcher = SequenceMatcher(None, truth_words, rec_words)
-    substitutions = []
+    Returns:
+        Tuple of (lisp_counts, per-occurrence details, complete) where
+        ``complete`` is False if only part of the phrase could be scored
+    """
+    lisp_counts = {
+        "interdental": 0,
+        "palatal": 0,
+        "lateral": 0,
+        "dentalized": 0,
+        "total": 0,
+    }
+    sibilants = []
+
+    targets = reference["targets"]
+    usable = alignable_prefix(targets, logits.shape[1])
+    complete = usable == len(targets)
+
+    # Only /s/ sounds entirely inside the alignable prefix can be located
+    scored = [
+        (span, ranges)
+        for span, ranges in zip(reference["s_spans"], reference["feature_ranges"])
+        if span[1] < usable
+    ]
+    if not scored:
+        return lisp_counts, sibilants, complete
+
+    log_probs = torch.log_softmax(logits, dim=-1).cpu()
+    alignment, frame_log_probs = ctc_forced_align(
+        log_probs, [targets[:usable]], blank=blank
+    )
+    regions = find_sibilant_regions(
+        alignment[0], frame_log_probs[0], [span for span, _ in scored], sr
+    )
 
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == "replace":
-            for k in range(max(i2 - i1, j2 - j1)):
-                truth_word = truth_words[i1 + k] if i1 + k < i2 else ""
-                rec_word = rec_words[j1 + k] if j1 + k < j2 else ""
+    for region, (_, ranges) in zip(regions, scored):
+        start, end = region["start"], region["end"]
+        features = extract_acoustic_features(audio, sr, start, end)
+        if features is None:
+            continue
 
-                if "s" in truth_word.lower() and truth_word.lower() != rec_word.lower():
-                    # Classify substitution type
-                    if "th" in rec_word.lower() or "h" in rec_word.lower():
-                        substitutions.append("interdental")
-                    elif "sh" in rec_word.lower():
-                        substitutions.append("palatal")
-                    elif "f" in rec_word.lower():
-                        substitutions.append("interdental")
-                    else:
-                        substitutions.append("interdental")  # Default
+        low, high = ranges["centroid"]
+        if low <= features["centroid"] <= high:
+            lisp_type = "normal"
+        else:
+            lisp_type = classify_acoustic_lisp(features)
+
+        if lisp_type != "normal":
+            lisp_counts[lisp_type] += 1
+            lisp_counts["total"] += 1
+
+        sibilants.append(
+            {
+                "start": start,
+                "end": end,
+                "confidence": region["confidence"],
+                "type": lisp_type,
+                "features": {k: float(v) for k, v in features.items()},
+            }
+        )
 
-    return substitutions
+    return lisp_counts, sibilants, complete
 
 
 # Global cache for model
@@ -181,9 +400,17 @@ def get_model(model_name="facebook/wav2vec2-base-960h"):
     return _MODEL_CACHE[model_name]
 
 
-def analyze_speech(truth_path, recorded_path):
+def analyze_speech(truth_path, recorded_path, truth_id=None):
     """
-    Hybrid lisp detection: Combines phoneme substitution + acoustic analysis.
+    Hybrid lisp detection: Forced alignment against the reference phrase +
+    acoustic analysis of every aligned /s/.
+
+    ``truth_path`` and ``recorded_path`` are audio file paths or audio
+    container bytes (see audio_container).
+
+    When the truth phrase is in the precomputed reference index (by
+    ``truth_id`` or by the truth audio's content hash) the truth audio is not
+    run through the model at all.
 
     Returns:
         Dictionary with counts for each lisp type:
@@ -203,44 +430,57 @@ def analyze_speech(truth_path, recorded_path):
         processor, model, device = get_model()
         logger.info("Model loaded successfully")
 
-        # Load audio
-        logger.info(f"Loading truth audio from: {truth_path}")
-        audio_truth, sr_truth = load_audio(truth_path)
-        logger.info(f"Truth audio loaded: {len(audio_truth)} samples at {sr_truth}Hz")
+        reference = get_reference(
+            truth_id=truth_id, truth_path=truth_path, tokenizer=processor.tokenizer
+        )
 
-        logger.info(f"Loading recorded audio from: {recorded_path}")
+        if reference is not None:
+            logger.info(f"Using precomputed reference: '{reference['text']}'")
+            transcription_truth = reference["normalized"].replace("|", " ")
+        else:
+            if truth_path is None:
+                raise ValueError(f"Unknown truth_id and no truth audio: {truth_id}")
+
+            logger.info("Loading truth audio...")
+            audio_truth, sr_truth = load_audio(truth_path)
+            logger.info(f"Truth audio loaded: {len(audio_truth)} samples at {sr_truth}Hz")
+
+            logger.info("Getting truth transcription...")
+            transcription_truth, _ = get_transcription(
+                audio_truth, processor, model, device
+            )
+            logger.info(f"Truth transcription: '{transcription_truth}'")
+            reference = build_reference_entry(transcription_truth, processor.tokenizer)
+            remember_reference(truth_path, reference)
+
+        logger.info("Loading recorded audio...")
         audio_rec, sr_rec = load_audio(recorded_path)
         logger.info(f"Recorded audio loaded: {len(audio_rec)} samples at {sr_rec}Hz")
 
-        # Get transcriptions
-        logger.info("Getting truth transcription...")
-        transcription_truth, logits_truth = get_transcription(
-            audio_truth, processor, model, device
-        )
-        logger.info(f"Truth transcription: '{transcription_truth}'")
-
         logger.info("Getting recorded transcription...")
         transcription_rec, logits_rec = get_transcription(
             audio_rec, processor, model, device
         )
         logger.info(f"Recorded transcription: '{transcription_rec}'")
 
-        logger.info(f"Recorded transcription: '{transcription_rec}'")
-
-        # Initialize counts
-        lisp_counts = {
-            "interdental": 0,
-            "palatal": 0,
-            "lateral": 0,
-            "dentalized": 0,
-            "total": 0,
-        }
+        lisp_counts, sibilants, complete = score_sibilants(
+            audio_rec,
+            sr_rec,
+            logits_rec,
+            reference,
+            blank=processor.tokenizer.pad_token_id,
+        )
+        logger.info(f"Lisp analysis: {lisp_counts}")
+        if not complete:
+            logger.info("Recording is shorter than the phrase; scored a prefix")
 
         # Return transcriptions for the UI
         return {
             "truth_transcription": transcription_truth,
             "recorded_transcription": transcription_rec,
             "lisp_analysis": lisp_counts,
+            "sibilants": sibilants,
+            "incomplete": not complete,
         }
 
     except Exception as e:
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Compact Audio Container
+Versioned binary format for uploading fixed-rate mono audio to /analyze
+without a lossy codec round trip through pydub/ffmpeg.
+
+Layout (little-endian):
+    magic        4 bytes   b"PHNV"
+    version      uint8     1
+    codec        uint8     0 = int16 PCM, 1 = Opus frames
+    channels     uint8     must be 1
+    reserved     uint8     0
+    sample_rate  uint32    16000 for input that skips resampling
+    num_samples  uint32    decoded sample count
+    payload:
+        PCM:  num_samples int16 samples
+        Opus: repeated (uint16 frame length, frame bytes)
+
+PCM costs 256 kbps at 16 kHz; encode_opus produces ~24 kbps containers for
+uploads where bandwidth matters. Opus needs opuslib and the libopus library.
+"""
+
+import math
+import struct
+
+import numpy as np
+
+MAGIC = b"PHNV"
+VERSION = 1
+CODEC_PCM16 = 0
+CODEC_OPUS = 1
+
+EXTENSION = ".phnv"
+
+_HEADER = struct.Struct("<4sBBBBII")
+HEADER_SIZE = _HEADER.size
+
+# Reject payloads longer than this to bound memory per request
+MAX_SECONDS = 120
+
+# Sample rates the Opus decoder supports
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Shortest and longest Opus frame durations, in milliseconds
+OPUS_MIN_FRAME_MS = 2.5
+OPUS_MAX_FRAME_MS = 120
+
+
+def is_container(data):
+    """Check whether bytes start with the container magic."""
+    return bytes(data[:4]) == MAGIC
+
+
+def parse_header(data):
+    """
+    Parse and validate a container header.
+
+    Returns:
+        Dictionary with version, codec, channels, sample_rate and num_samples
+
+    Raises:
+        ValueError: If the header is malformed or unsupported
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Audio container is truncated")
+
+    magic, version, codec, channels, _, sample_rate, num_samples = _HEADER.unpack_from(
+        data
+    )
+    if magic != MAGIC:
+        raise ValueError("Not an audio container")
+    if version != VERSION:
+        raise ValueError(f"Unsupported audio container version: {version}")
+    if codec not in (CODEC_PCM16, CODEC_OPUS):
+        raise ValueError(f"Unsupported audio container codec: {codec}")
+    if channels != 1:
+        raise ValueError("Audio container must be mono")
+    if not 8000 <= sample_rate <= 48000:
+        raise ValueError(f"Unsupported sample rate: {sample_rate}")
+    if codec == CODEC_OPUS and sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(
+            f"Unsupported Opus sample rate: {sample_rate} "
+            f"(supported: {', '.join(str(rate) for rate in OPUS_SAMPLE_RATES)})"
+        )
+    if num_samples == 0:
+        raise ValueError("Audio container is empty")
+    if num_samples > MAX_SECONDS * sample_rate:
+        raise ValueError(f"Audio container is longer than {MAX_SECONDS}s")
+
+    return {
+        "version": version,
+        "codec": codec,
+        "channels": channels,
+        "sample_rate": sample_rate,
+        "num_samples": num_samples,
+    }
+
+
+def _opus_frames(payload):
+    """Split an Opus payload into its length-prefixed frames."""
+    frames = []
+    offset = 0
+    while offset < len(payload):
+        if offset + 2 > len(payload):
+            raise ValueError("Truncated Opus frame header")
+        (frame_len,) = struct.unpack_from("<H", payload, offset)
+        offset += 2
+        frame = bytes(payload[offset : offset + frame_len])
+        if len(frame) != frame_len:
+            raise ValueError("Truncated Opus frame")
+        offset += frame_len
+        frames.append(frame)
+    return frames
+
+
+def _load_opuslib():
+    try:
+        import opuslib
+    except Exception as e:
+        # opuslib raises a plain Exception when libopus itself is missing
+        raise ValueError(f"Opus containers are not supported on this server: {e}")
+    return opuslib
+
+
+def _check_payload(header, payload):
+    """Check that a payload's size and framing match its header."""
+    num_samples = header["num_samples"]
+    if header["codec"] == CODEC_PCM16:
+        if len(payload) != num_samples * 2:
+            raise ValueError(
+                f"PCM payload is {len(payload)} bytes, expected {num_samples * 2}"
+            )
+        return None
+
+    _load_opuslib()
+    frames = _opus_frames(payload)
+    if not frames:
+        raise ValueError("Opus payload has no frames")
+    # Every frame decodes to at least 2.5 ms, so more frames than this would
+    # decode to more audio than the header states
+    min_frame_samples = int(header["sample_rate"] * OPUS_MIN_FRAME_MS / 1000)
+    max_frames = math.ceil(num_samples / min_frame_samples)
+    if len(frames) > max_frames:
+        raise ValueError(
+            f"Opus payload has {len(frames)} frames, more than {max_frames} "
+            f"for {num_samples} samples"
+        )
+    return frames
+
+
+def validate_container(data):
+    """
+    Validate a container's header and payload framing without decoding it.
+
+    Returns:
+        The parsed header (see parse_header)
+
+    Raises:
+        ValueError: If the container is malformed or unsupported
+    """
+    header = parse_header(data)
+    _check_payload(header, memoryview(data)[HEADER_SIZE:])
+    return header
+
+
+def _decode_opus(frames, sample_rate, num_samples):
+    """Decode Opus frames into exactly ``num_samples`` int16 samples."""
+    opuslib = _load_opuslib()
+    decoder = opuslib.Decoder(sample_rate, 1)
+    max_frame_samples = sample_rate * OPUS_MAX_FRAME_MS // 1000
+
+    # Decode into a buffer sized by the header; stop once it is full
+    samples = np.empty(num_samples, dtype="<i2")
+    filled = 0
+    for frame in frames:
+        try:
+            pcm = decoder.decode(frame, max_frame_samples)
+        except opuslib.OpusError as e:
+            raise ValueError(f"Invalid Opus frame: {str(e)}")
+        decoded = np.frombuffer(pcm, dtype="<i2")
+        take = min(len(decoded), num_samples - filled)
+        samples[filled : filled + take] = decoded[:take]
+        filled += take
+        if filled == num_samples:
+            break
+
+    if filled < num_samples:
+        raise ValueError("Opus payload is shorter than the header states")
+    return samples
+
+
+def decode_container(data):
+    """
+    Decode a container into float32 samples in [-1, 1].
+
+    PCM payloads are viewed in place (``data`` may be bytes, a memoryview or
+    a numpy memmap) and only converted once to float32.
+
+    Returns:
+        Tuple of (audio, sample_rate)
+    """
+    header = parse_header(data)
+    payload = memoryview(data)[HEADER_SIZE:]
+    num_samples = header["num_samples"]
+    frames = _check_payload(header, payload)
+
+    if header["codec"] == CODEC_PCM16:
+        samples = np.frombuffer(payload, dtype="<i2", count=num_samples)
+    else:
+        samples = _decode_opus(frames, header["sample_rate"], num_samples)
+
+    audio = samples.astype(np.float32)
+    audio *= 1.0 / 32768.0
+    return audio, header["sample_rate"]
+
+
+def read_container(path):
+    """Memory-map a container file and decode it."""
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    return decode_container(data)
+
+
+def encode_pcm16(audio, sample_rate=16000):
+    """
+    Encode float samples in [-1, 1] as an int16 PCM container.
+
+    Returns:
+        bytes: Container ready to upload
+    """
+    samples = np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0)
+    pcm = (samples * 32767.0).astype("<i2")
+    header = _HEADER.pack(MAGIC, VERSION, CODEC_PCM16, 1, 0, sample_rate, len(pcm))
+    return header + pcm.tobytes()
+
+
+def encode_opus(audio, sample_rate=16000, bitrate=24000, frame_ms=20):
+    """
+    Encode float samples in [-1, 1] as an Opus container.
+
+    Args:
+        audio: Mono samples
+        sample_rate: One of OPUS_SAMPLE_RATES
+        bitrate: Target bits per second
+        frame_ms: Frame duration (2.5, 5, 10, 20, 40 or 60)
+
+    Returns:
+        bytes: Container ready to upload
+    """
+    if sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"Unsupported Opus sample rate: {sample_rate}")
+
+    opuslib = _load_opuslib()
+    encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+    encoder.bitrate = bitrate
+
+    samples = np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0)
+    pcm = (samples * 32767.0).astype("<i2")
+    frame_size = int(sample_rate * frame_ms / 1000)
+    # Zero-pad the last frame; num_samples trims it again on decode
+    padded = np.zeros(math.ceil(len(pcm) / frame_size) * frame_size, dtype="<i2")
+    padded[: len(pcm)] = pcm
+
+    payload = bytearray()
+    for start in range(0, len(padded), frame_size):
+        packet = encoder.encode(
+            padded[start : start + frame_size].tobytes(), frame_size
+        )
+        payload += struct.pack("<H", len(packet)) + packet
+
+    header = _HEADER.pack(MAGIC, VERSION, CODEC_OPUS, 1, 0, sample_rate, len(pcm))
+    return header + bytes(payload)
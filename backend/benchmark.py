@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmark Harness
+Starts the API server with a stubbed ElevenLabs client, drives its endpoints
+at a configurable concurrency using the files in sound_samples/, and records
+latency percentiles, throughput, server CPU and RSS as JSON so runs from
+different commits can be compared.
+
+Usage:
+    python benchmark.py run [--scenarios analyze,tts_generate] [--concurrency 4]
+    python benchmark.py compare baseline.json candidate.json
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import tempfile
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SOUND_SAMPLES_DIR = os.path.join(BACKEND_DIR, "sound_samples")
+DEFAULT_OUTPUT_DIR = os.path.join(BACKEND_DIR, "benchmark_results")
+
+SCENARIOS = ["analyze", "analyze_pcm", "tts_generate", "tts_stitch", "audio"]
+
+
+class _StubElevenLabs:
+    """Stands in for the ElevenLabs client: returns a canned MP3 after a delay."""
+
+    def __init__(self, latency):
+        self.text_to_speech = self
+        self.latency = latency
+        with open(os.path.join(SOUND_SAMPLES_DIR, "test_phrase.mp3"), "rb") as f:
+            self.audio = f.read()
+
+    def convert(self, **kwargs):
+        time.sleep(self.latency)
+        chunk = 4096
+        return (self.audio[i : i + chunk] for i in range(0, len(self.audio), chunk))
+
+
+def serve(port, stub_latency):
+    """Run the API server with ElevenLabs stubbed out (benchmark child process)."""
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+    import tts
+
+    tts.client = _StubElevenLabs(stub_latency)
+
+    import server
+
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _read_sample(name):
+    with open(os.path.join(SOUND_SAMPLES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+            f"\r\n\r\n{value}\r\n".encode()
+        )
+    for name, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\nContent-Type: audio/mpeg\r\n\r\n'.encode()
+            + data
+            + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _read_sample_container(name):
+    """Decode a sample to 16 kHz and wrap it in the /analyze audio container."""
+    import librosa
+    from audio_container import encode_pcm16
+
+    audio, sr = librosa.load(os.path.join(SOUND_SAMPLES_DIR, name), sr=16000)
+    return encode_pcm16(audio, sr)
+
+
+def build_requests(base_url, scenarios):
+    """Return scenario name -> callable building a urllib Request."""
+    phrase = _read_sample("test_phrase.mp3")
+    s_sound = _read_sample("s_sound.mp3")
+    if "analyze_pcm" in scenarios:
+        phrase_pcm = _read_sample_container("test_phrase.mp3")
+        s_sound_pcm = _read_sample_container("s_sound.mp3")
+
+    def analyze():
+        body, content_type = _multipart(
+            {},
+            [
+                ("truth_audio", "truth_audio.mp3", phrase),
+                ("recorded_audio", "recorded_audio.mp3", s_sound),
+            ],
+        )
+        return urllib.request.Request(
+            f"{base_url}/analyze", data=body, headers={"Content-Type": content_type}
+        )
+
+    def analyze_pcm():
+        body, content_type = _multipart(
+            {},
+            [
+                ("truth_audio", "truth_audio.phnv", phrase_pcm),
+                ("recorded_audio", "recorded_audio.phnv", s_sound_pcm),
+            ],
+        )
+        return urllib.request.Request(
+            f"{base_url}/analyze", data=body, headers={"Content-Type": content_type}
+        )
+
+    def tts_generate():
+        body, content_type = _multipart({"text": "Sally sells sea shells"}, [])
+        return urllib.request.Request(
+            f"{base_url}/tts/generate",
+            data=body,
+            headers={"Content-Type": content_type},
+        )
+
+    def tts_stitch():
+        body, content_type = _multipart(
+            {"pause_duration": "500"},
+            [
+                ("audio_files", "a.mp3", phrase),
+                ("audio_files", "b.mp3", s_sound),
+            ],
+        )
+        return urllib.request.Request(
+            f"{base_url}/tts/stitch", data=body, headers={"Content-Type": content_type}
+        )
+
+    def audio():
+        return urllib.request.Request(f"{base_url}/audio/test_phrase.mp3")
+
+    return {
+        "analyze": analyze,
+        "analyze_pcm": analyze_pcm,
+        "tts_generate": tts_generate,
+        "tts_stitch": tts_stitch,
+        "audio": audio,
+    }
+
+
+class ProcessSampler(threading.Thread):
+    """Samples a process's CPU time and RSS from /proc (Linux) or psutil."""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.rss_samples = []
+        self._stop_event = threading.Event()
+        try:
+            import psutil
+
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def cpu_seconds(self):
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self):
+        if self._process is not None:
+            return self._process.memory_info().rss
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.rss_samples.append(self.rss_bytes())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _timed_request(make_request, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(make_request(), timeout=timeout) as response:
+            response.read()
+        ok = True
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_scenario(make_request, sampler, requests, concurrency, warmup, timeout):
+    """Drive one scenario and summarize latency, throughput and server load."""
+    for _ in range(warmup):
+        _timed_request(make_request, timeout)
+
+    rss_start = len(sampler.rss_samples)
+    cpu_start = sampler.cpu_seconds()
+    wall_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(
+            pool.map(lambda _: _timed_request(make_request, timeout), range(requests))
+        )
+
+    wall = time.perf_counter() - wall_start
+    cpu = sampler.cpu_seconds() - cpu_start
+    rss = sampler.rss_samples[rss_start:] or [sampler.rss_bytes()]
+
+    latencies = [latency for latency, ok in outcomes if ok]
+
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "concurrency": concurrency,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "server_cpu_seconds": round(cpu, 3),
+        "server_cpu_percent": round(100 * cpu / wall, 1),
+        "server_rss_mb_peak": round(max(rss) / 2**20, 1),
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_server(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"Server did not become healthy within {timeout}s")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Start a stubbed server, run the selected scenarios and save the results."""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Fresh server state per run, so earlier runs and the real databases,
+    # caches and tuning file never influence the measurements
+    state_dir = tempfile.mkdtemp(prefix="state-", dir=args.output_dir)
+    env = dict(os.environ)
+    env.update(
+        {
+            # Measure inference, not cache lookups of the warmup payload
+            "ANALYZE_CACHE_SIZE": "256" if args.cache else "0",
+            "INFERENCE_AUTOTUNE": "1" if args.autotune else "0",
+            "INFERENCE_CONCURRENCY": str(args.inference_concurrency),
+            "INFERENCE_TUNING_PATH": os.path.join(state_dir, "inference_tuning.json"),
+            "ANALYZE_JOB_DB": os.path.join(state_dir, "analyze_jobs.db"),
+            "PROGRESS_DB": os.path.join(state_dir, "progress.db"),
+            "CLONE_REGISTRY_DB": os.path.join(state_dir, "voice_clones.db"),
+            "PROFILE_DIR": os.path.join(state_dir, "profiles"),
+            "TTS_CACHE_DIR": os.path.join(state_dir, "tts_cache"),
+        }
+    )
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "serve",
+            "--port",
+            str(port),
+            "--stub-latency",
+            str(args.stub_latency),
+        ],
+        env=env,
+    )
+    sampler = ProcessSampler(process.pid)
+
+    try:
+        startup_start = time.perf_counter()
+        _wait_for_server(base_url, process, args.startup_timeout)
+        startup = time.perf_counter() - startup_start
+        print(f"Server ready in {startup:.1f}s on {base_url}")
+
+        with urllib.request.urlopen(f"{base_url}/diagnostics", timeout=10) as resp:
+            diagnostics = json.load(resp)
+
+        sampler.start()
+        requests = build_requests(base_url, args.scenarios)
+        results = {}
+        for name in args.scenarios:
+            print(f"Running {name}: {args.requests} requests x{args.concurrency}")
+            results[name] = run_scenario(
+                requests[name],
+                sampler,
+                args.requests,
+                args.concurrency,
+                args.warmup,
+                args.timeout,
+            )
+            print(json.dumps(results[name], indent=2))
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        process.terminate()
+        process.wait()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "stub_latency": args.stub_latency,
+            "cache": args.cache,
+            "autotune": args.autotune,
+            "inference_concurrency": args.inference_concurrency,
+            "cpu_count": os.cpu_count(),
+            "server": diagnostics,
+        },
+        "startup_seconds": round(startup, 2),
+        "results": results,
+    }
+
+    output = args.output or os.path.join(
+        args.output_dir, f"{(report['commit'] or 'unknown')[:12]}.json"
+    )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+def compare(args):
+    """Print per-scenario deltas between two result files; exit 1 on regression."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressed = False
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "server_rss_mb_peak"]
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        print(f"{name}:")
+
+        # Any new failures count, even when the baseline had none
+        old_rate = old.get("errors", 0) / max(old.get("requests", 1), 1)
+        new_rate = new.get("errors", 0) / max(new.get("requests", 1), 1)
+        flag = ""
+        if new_rate > old_rate and (
+            old_rate == 0 or (new_rate - old_rate) / old_rate > args.threshold
+        ):
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"  {'error_rate':20s} {old_rate:>10.1%} -> {new_rate:>10.1%}{flag}")
+
+        for metric in metrics:
+            if old.get(metric) in (None, 0):
+                continue
+            if new.get(metric) is None:
+                # Latencies are None when every request failed
+                regressed = True
+                print(f"  {metric:20s} {old[metric]:>10} -> {'n/a':>10}  REGRESSION")
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            # Higher throughput is better; every other metric is lower-is-better
+            worse = -change if metric == "throughput_rps" else change
+            flag = "  REGRESSION" if worse > args.threshold else ""
+            regressed = regressed or bool(flag)
+            print(
+                f"  {metric:20s} {old[metric]:>10} -> {new[metric]:>10} "
+                f"({change:+.1%}){flag}"
+            )
+
+    sys.exit(1 if regressed else 0)
+
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Benchmark a stubbed server")
+    run_parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=SCENARIOS,
+        help=f"Comma-separated subset of {','.join(SCENARIOS)}",
+    )
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument("--requests", type=int, default=50)
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument("--timeout", type=float, default=120)
+    run_parser.add_argument("--startup-timeout", type=float, default=300)
+    run_parser.add_argument(
+        "--stub-latency",
+        type=float,
+        default=0.3,
+        help="Seconds the stubbed ElevenLabs call takes",
+    )
+    run_parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Keep the /analyze result cache on (default: off, so every "
+        "request runs inference)",
+    )
+    run_parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Let the server autotune inference (default: torch defaults)",
+    )
+    run_parser.add_argument(
+        "--inference-concurrency",
+        type=int,
+        default=2,
+        help="INFERENCE_CONCURRENCY for the server",
+    )
+    run_parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    run_parser.add_argument("--output", help="Result file (default: <commit>.json)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change counted as a regression (default 0.1 = 10%%)",
+    )
+
+    serve_parser = commands.add_parser(
+        "serve", help="Run the stubbed server (started by run)"
+    )
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--stub-latency", type=float, default=0.3)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        unknown = set(args.scenarios) - set(SCENARIOS)
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        run(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        serve(args.port, args.stub_latency)
+
+
+if __name__ == "__main__":
+    main()
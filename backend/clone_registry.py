@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Voice Clone Registry
+Remembers the voice clones created from uploaded samples so that a user who
+redoes onboarding gets their existing voice_id back instead of a duplicate
+clone. Samples are matched by content hash, and, for the same user, by an
+acoustic fingerprint that survives re-recording and re-encoding.
+"""
+
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Cosine similarity above which two samples from one user count as duplicates
+FINGERPRINT_THRESHOLD = 0.97
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clones (
+    voice_id TEXT PRIMARY KEY,
+    content_sha256 TEXT NOT NULL,
+    fingerprint TEXT,
+    user_id TEXT,
+    name TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clones_sha256 ON clones (content_sha256);
+CREATE INDEX IF NOT EXISTS clones_user ON clones (user_id);
+"""
+
+
+def acoustic_fingerprint(audio_bytes, sr=16000, n_mfcc=20):
+    """
+    Summarize a voice sample as a unit vector of MFCC means and deviations.
+
+    The energy coefficient is dropped so recording level does not matter.
+
+    Returns:
+        np.ndarray or None if the audio cannot be decoded
+    """
+    import librosa
+    from pydub import AudioSegment
+
+    try:
+        segment = AudioSegment.from_file(io.BytesIO(audio_bytes))
+    except Exception:
+        return None
+
+    segment = segment.set_channels(1).set_frame_rate(sr).set_sample_width(2)
+    audio = np.frombuffer(segment.raw_data, dtype=np.int16).astype(np.float32)
+    audio /= 32768.0
+    if len(audio) < sr // 2:
+        return None
+
+    mfcc = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=n_mfcc)[1:]
+    vector = np.concatenate([mfcc.mean(axis=1), mfcc.std(axis=1)])
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+class CloneRegistry:
+    """
+    SQLite-backed map of uploaded voice samples to ElevenLabs voice IDs.
+
+    Args:
+        db_path: SQLite database file
+        threshold: Fingerprint cosine similarity counted as the same sample
+    """
+
+    def __init__(self, db_path, threshold=FINGERPRINT_THRESHOLD):
+        self.db_path = db_path
+        self.threshold = threshold
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _lock(self, key):
+        """Serialize work on one key so concurrent duplicates clone once."""
+        with self._locks_guard:
+            lock, users = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_guard:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+
+    def find(self, content_sha256, fingerprint=None, user_id=None):
+        """
+        Find an existing clone for a sample.
+
+        Returns:
+            str or None: The matching voice_id
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT voice_id FROM clones WHERE content_sha256 = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (content_sha256,),
+            ).fetchone()
+            if row is not None:
+                return row["voice_id"]
+
+            if fingerprint is None or user_id is None:
+                return None
+
+            candidates = conn.execute(
+                "SELECT voice_id, fingerprint FROM clones "
+                "WHERE user_id = ? AND fingerprint IS NOT NULL",
+                (user_id,),
+            ).fetchall()
+
+        best_id, best_score = None, self.threshold
+        for candidate in candidates:
+            score = float(np.dot(fingerprint, json.loads(candidate["fingerprint"])))
+            if score >= best_score:
+                best_id, best_score = candidate["voice_id"], score
+        return best_id
+
+    def add(self, voice_id, content_sha256, fingerprint=None, user_id=None, name=None):
+        """Register a newly created clone."""
+        if fingerprint is not None:
+            fingerprint = json.dumps(fingerprint.tolist())
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO clones VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    voice_id,
+                    content_sha256,
+                    fingerprint,
+                    user_id,
+                    name,
+                    time.time(),
+                ),
+            )
+
+    def get_or_create(self, audio_bytes, create, user_id=None, name=None):
+        """
+        Return the voice_id for a sample, creating the clone only if needed.
+
+        Args:
+            audio_bytes: Uploaded voice sample
+            create: Callable(audio_bytes) -> voice_id for a new clone
+            user_id: Owner, enables fingerprint matching across re-recordings
+            name: Clone name, stored for reference
+
+        Returns:
+            Tuple of (voice_id, created)
+        """
+        content_sha256 = hashlib.sha256(audio_bytes).hexdigest()
+
+        with self._lock(user_id or content_sha256):
+            voice_id = self.find(content_sha256)
+            if voice_id is not None:
+                return voice_id, False
+
+            fingerprint = acoustic_fingerprint(audio_bytes)
+            voice_id = self.find(content_sha256, fingerprint, user_id)
+            if voice_id is not None:
+                return voice_id, False
+
+            voice_id = create(audio_bytes)
+            self.add(voice_id, content_sha256, fingerprint, user_id, name)
+            return voice_id, True
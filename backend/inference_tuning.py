@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+CPU Inference Autotuning
+Benchmarks torch intra-op thread counts and optional bfloat16 autocast for
+wav2vec2 at the configured request concurrency, keeps the fastest
+configuration that still transcribes like float32, and persists it per host
+so later startups apply it without re-benchmarking.
+
+Server processes on one host share the persisted file: a lock next to it
+lets one process benchmark while the others wait and then reuse its result.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each process may tune
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TUNING_PATH = os.getenv(
+    "INFERENCE_TUNING_PATH",
+    os.path.join(os.path.dirname(__file__), "inference_tuning.json"),
+)
+
+# Minimum share of frames whose argmax token must match float32 for bf16
+BF16_MIN_AGREEMENT = 0.98
+
+# Settings applied to inference; updated by apply_settings
+_SETTINGS = {
+    "device": None,
+    "bf16_autocast": False,
+    "concurrency": 1,
+    "source": "default",
+    "benchmark": [],
+}
+
+# Bounds concurrent forward passes to the concurrency the tuning assumed
+_SLOTS = threading.BoundedSemaphore(1)
+
+
+def current_settings():
+    """Return a copy of the inference settings in effect."""
+    settings = dict(_SETTINGS)
+    settings["intra_op_threads"] = torch.get_num_threads()
+    settings["inter_op_threads"] = torch.get_num_interop_threads()
+    return settings
+
+
+def set_concurrency(device, concurrency):
+    """Record the device and allow ``concurrency`` simultaneous forward passes."""
+    global _SLOTS
+
+    _SETTINGS["device"] = device
+    _SETTINGS["concurrency"] = concurrency
+    _SLOTS = threading.BoundedSemaphore(concurrency)
+
+
+@contextlib.contextmanager
+def inference_context():
+    """
+    Context manager for a model forward pass: waits for one of the
+    ``concurrency`` inference slots and applies the tuned precision.
+    """
+    slots = _SLOTS
+    with slots:
+        if _SETTINGS["bf16_autocast"] and _SETTINGS["device"] == "cpu":
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                yield
+        else:
+            yield
+
+
+def host_signature(concurrency):
+    """Identify the host and workload a persisted tuning is valid for."""
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "concurrency": concurrency,
+    }
+
+
+def configure_inter_op_threads(threads):
+    """
+    Set the inter-op pool size.
+
+    torch only allows this before any parallel work runs, so it is applied
+    once at startup; later calls are logged and ignored.
+    """
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError as e:
+        logger.warning(f"Could not set inter-op threads to {threads}: {str(e)}")
+
+
+def apply_settings(settings):
+    """Apply tuned settings to torch and to inference_context."""
+    torch.set_num_threads(settings["intra_op_threads"])
+    if settings["inter_op_threads"] != torch.get_num_interop_threads():
+        configure_inter_op_threads(settings["inter_op_threads"])
+    _SETTINGS.update(settings)
+
+
+def _candidate_threads(concurrency):
+    """Intra-op thread counts worth trying: powers of two up to a fair share."""
+    share = max(1, (os.cpu_count() or 1) // concurrency)
+    candidates = {1, share}
+    threads = 2
+    while threads < share:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def _bf16_supported():
+    try:
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            torch.ones(2, 2) @ torch.ones(2, 2)
+        return True
+    except (RuntimeError, TypeError):
+        return False
+
+
+def _measure(model, input_values, concurrency, iterations, bf16):
+    """Run ``concurrency`` threads of forward passes; return passes per second."""
+
+    def worker():
+        context = (
+            torch.autocast("cpu", dtype=torch.bfloat16)
+            if bf16
+            else contextlib.nullcontext()
+        )
+        with torch.no_grad(), context:
+            for _ in range(iterations):
+                model(input_values)
+
+    worker_threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in worker_threads:
+        thread.start()
+    for thread in worker_threads:
+        thread.join()
+    return concurrency * iterations / (time.perf_counter() - start)
+
+
+def _argmax_agreement(model, input_values):
+    """Share of frames whose argmax token is unchanged under bf16 autocast."""
+    with torch.no_grad():
+        reference = model(input_values).logits.argmax(dim=-1)
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            candidate = model(input_values).logits.float().argmax(dim=-1)
+    return (reference == candidate).float().mean().item()
+
+
+def benchmark(model, input_values, concurrency, iterations=3):
+    """
+    Measure throughput for each thread count, with and without bf16 autocast.
+
+    Returns:
+        list: One dict per configuration with its throughput
+    """
+    bf16_options = [False]
+    if _bf16_supported():
+        agreement = _argmax_agreement(model, input_values)
+        logger.info(f"bf16 argmax agreement with float32: {agreement:.3f}")
+        if agreement >= BF16_MIN_AGREEMENT:
+            bf16_options.append(True)
+
+    results = []
+    for threads in _candidate_threads(concurrency):
+        torch.set_num_threads(threads)
+        for bf16 in bf16_options:
+            # Warm up kernels for this configuration
+            _measure(model, input_values, concurrency, 1, bf16)
+            throughput = _measure(model, input_values, concurrency, iterations, bf16)
+            logger.info(
+                f"threads={threads} bf16={bf16}: {throughput:.2f} passes/s "
+                f"at concurrency {concurrency}"
+            )
+            results.append(
+                {
+                    "intra_op_threads": threads,
+                    "bf16_autocast": bf16,
+                    "throughput": round(throughput, 3),
+                }
+            )
+    return results
+
+
+def _read_tuning(path):
+    """
+    Return the persisted tuning, or None if it is missing or unreadable.
+
+    A corrupt file is treated as "not tuned" so it is benchmarked again.
+    """
+    try:
+        with open(path) as f:
+            persisted = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable inference tuning {path}: {str(e)}")
+        return None
+
+    settings = persisted.get("settings") if isinstance(persisted, dict) else None
+    required = ("intra_op_threads", "inter_op_threads")
+    if not isinstance(settings, dict) or not all(key in settings for key in required):
+        logger.warning(f"Ignoring malformed inference tuning {path}")
+        return None
+    return persisted
+
+
+def _write_tuning(path, persisted):
+    """Write the tuning via a temp file and rename, so readers never see it partial."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(persisted, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def _tuning_lock(path):
+    """Hold an exclusive lock on ``path + ".lock"`` across processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _apply_persisted(path, signature):
+    """Apply the persisted tuning if it matches ``signature``; return whether it did."""
+    persisted = _read_tuning(path)
+    if persisted is None or persisted.get("signature") != signature:
+        return False
+    logger.info(f"Applying persisted inference tuning from {path}")
+    apply_settings(dict(persisted["settings"], source="persisted"))
+    return True
+
+
+def autotune(
+    model,
+    device,
+    input_values,
+    concurrency=1,
+    path=DEFAULT_TUNING_PATH,
+    force=False,
+):
+    """
+    Pick and apply the fastest inference configuration for this host.
+
+    A persisted tuning for the same host signature is reused unless
+    ``force`` is set. Only one process benchmarks at a time; others wait
+    for it and reuse its result. GPU inference is left untouched.
+
+    Args:
+        model: wav2vec2 model
+        device: "cuda" or "cpu"
+        input_values: Representative model input, shape (1, samples)
+        concurrency: Expected concurrent inference requests
+        path: JSON file the tuning is persisted to
+
+    Returns:
+        dict: The settings in effect
+    """
+    set_concurrency(device, concurrency)
+    if device != "cpu":
+        return current_settings()
+
+    signature = host_signature(concurrency)
+    if not force and _apply_persisted(path, signature):
+        return current_settings()
+
+    with _tuning_lock(path):
+        # Another process may have finished tuning while this one waited
+        if not force and _apply_persisted(path, signature):
+            return current_settings()
+        return _benchmark_and_persist(
+            model, device, input_values, concurrency, path, signature
+        )
+
+
+def _benchmark_and_persist(model, device, input_values, concurrency, path, signature):
+    """Benchmark, persist and apply the fastest configuration."""
+    logger.info(f"Autotuning CPU inference for concurrency {concurrency}...")
+    results = benchmark(model, input_values.to(device), concurrency)
+    best = max(results, key=lambda result: result["throughput"])
+
+    settings = {
+        "device": device,
+        "intra_op_threads": best["intra_op_threads"],
+        # A single forward pass has no independent ops to overlap, and
+        # concurrency comes from request threads, so one inter-op thread
+        "inter_op_threads": 1,
+        "bf16_autocast": best["bf16_autocast"],
+        "concurrency": concurrency,
+        "benchmark": results,
+    }
+    _write_tuning(path, {"signature": signature, "settings": settings})
+
+    apply_settings(dict(settings, source="benchmarked"))
+    logger.info(
+        f"Selected {best['intra_op_threads']} intra-op threads, "
+        f"bf16={best['bf16_autocast']} ({best['throughput']:.2f} passes/s)"
+    )
+    return current_settings()
+
+
+def load_persisted_inter_op_threads(path=DEFAULT_TUNING_PATH):
+    """
+    Apply a persisted inter-op thread count before torch does any work.
+
+    Call once at process start, before the model is loaded.
+    """
+    persisted = _read_tuning(path)
+    if persisted is not None:
+        configure_inter_op_threads(persisted["settings"]["inter_op_threads"])
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Persistent Job Queue
+SQLite-backed queue drained by a pool of worker threads. Jobs and their
+input blobs are stored on disk, so queued (and interrupted) jobs are picked
+up again after a server restart.
+
+Several server processes may share one database: a claimed job is leased
+to the process running it and kept alive by a heartbeat, and only jobs
+whose lease has expired are requeued.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    lease_expires REAL,
+    dedup_key TEXT,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS job_blobs (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+# Columns added after the first release, for databases created before them
+_MIGRATIONS = [
+    ("owner", "TEXT"),
+    ("lease_expires", "REAL"),
+    ("dedup_key", "TEXT"),
+    ("idempotency_key", "TEXT"),
+]
+
+# Created after the migrations, since they index migrated columns
+_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup_key ON jobs (dedup_key)
+    WHERE dedup_key IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_idempotency_key ON jobs (idempotency_key)
+    WHERE idempotency_key IS NOT NULL;
+"""
+
+
+class JobConflict(Exception):
+    """Raised when an idempotency key is reused for a different submission."""
+
+
+class JobQueue:
+    """
+    Priority job queue with a bounded number of concurrent workers.
+
+    Args:
+        db_path: SQLite database file
+        handlers: Dict of job kind -> callable(params, blobs) returning a
+            JSON-serializable result
+        workers: Number of jobs processed concurrently
+        max_attempts: Times a job interrupted by a restart is retried
+        retention: Seconds finished jobs are kept before being purged
+        lease: Seconds a running job stays claimed without a heartbeat
+        maintenance_interval: Seconds between requeueing expired jobs and
+            purging finished ones
+        dedup_window: Seconds a finished job still answers duplicate submissions
+    """
+
+    def __init__(
+        self,
+        db_path,
+        handlers,
+        workers=1,
+        max_attempts=3,
+        retention=86400,
+        lease=60,
+        maintenance_interval=60,
+        dedup_window=600,
+    ):
+        self.db_path = db_path
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.lease = lease
+        self.maintenance_interval = maintenance_interval
+        self.dedup_window = dedup_window
+        # Identifies this queue instance as the owner of the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._stopped = threading.Event()
+        self._threads = []
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._last_maintenance = 0.0
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in _MIGRATIONS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("COMMIT")
+            conn.executescript(_INDEXES)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            # Closing without COMMIT rolls back a failed transaction
+            conn.close()
+
+    def start(self):
+        """Requeue jobs whose owner died and start the workers."""
+        self._maintain()
+
+        self._stopping = False
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"job-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(
+            target=self._heartbeat, name="job-heartbeat", daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    def _maintain(self):
+        """Requeue running jobs whose lease expired and purge old finished jobs."""
+        self._last_maintenance = time.time()
+        with self._connect() as conn:
+            # A NULL lease is a job claimed before leases existed
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, "
+                "owner = NULL, lease_expires = NULL WHERE status = 'running' "
+                "AND (lease_expires IS NULL OR lease_expires < ?)",
+                (time.time(),),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM job_blobs WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status IN ('done', 'failed') "
+                "AND finished_at < ?)",
+                (time.time() - self.retention,),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') "
+                "AND finished_at < ?",
+                (time.time() - self.retention,),
+            )
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def stop(self, timeout=None):
+        """Stop the workers after their current job."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _reusable(self, row):
+        """Whether an existing job should answer a duplicate submission."""
+        if row["status"] in ("queued", "running"):
+            return True
+        return (
+            row["status"] == "done"
+            and row["finished_at"] >= time.time() - self.dedup_window
+        )
+
+    def submit(
+        self,
+        kind,
+        params,
+        blobs=None,
+        priority=0,
+        dedup_key=None,
+        idempotency_key=None,
+    ):
+        """
+        Enqueue a job, unless an equivalent one is queued, running or
+        recently done.
+
+        Args:
+            kind: Handler name
+            params: JSON-serializable parameters
+            blobs: Dict of name -> bytes inputs
+            priority: Higher runs first
+            dedup_key: Key identifying the submission's content
+            idempotency_key: Client-supplied key identifying a retried request
+
+        Returns:
+            Tuple of (job_id, created)
+
+        Raises:
+            JobConflict: If ``idempotency_key`` was used for another dedup_key
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            for column, key in (
+                ("idempotency_key", idempotency_key),
+                ("dedup_key", dedup_key),
+            ):
+                if key is None:
+                    continue
+                row = conn.execute(
+                    f"SELECT id, status, finished_at, dedup_key FROM jobs "
+                    f"WHERE {column} = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    continue
+                if self._reusable(row):
+                    conn.execute("COMMIT")
+                    if column == "idempotency_key" and row["dedup_key"] != dedup_key:
+                        raise JobConflict(
+                            f"Idempotency-Key {key} was used with a different payload"
+                        )
+                    return row["id"], False
+                # Failed or stale: release the key for the new job
+                conn.execute(
+                    f"UPDATE jobs SET {column} = NULL WHERE id = ?", (row["id"],)
+                )
+
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, params, created_at, "
+                "dedup_key, idempotency_key) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    priority,
+                    json.dumps(params),
+                    time.time(),
+                    dedup_key,
+                    idempotency_key,
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO job_blobs (job_id, name, data) VALUES (?, ?, ?)",
+                [(job_id, name, data) for name, data in (blobs or {}).items()],
+            )
+            conn.execute("COMMIT")
+
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id, True
+
+    def get(self, job_id):
+        """Return a job's status and result, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+
+            job = {
+                "job_id": row["id"],
+                "status": row["status"],
+                "priority": row["priority"],
+                "created_at": row["created_at"],
+                "started_at": row["started_at"],
+                "finished_at": row["finished_at"],
+            }
+            if row["status"] == "queued":
+                job["position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                    "(priority > ? OR (priority = ? AND created_at < ?))",
+                    (row["priority"], row["priority"], row["created_at"]),
+                ).fetchone()[0]
+            if row["result"] is not None:
+                job["result"] = json.loads(row["result"])
+            if row["error"] is not None:
+                job["error"] = row["error"]
+            return job
+
+    def _claim(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind, params, attempts FROM jobs WHERE status = 'queued' "
+                "ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, "
+                "attempts = attempts + 1, owner = ?, lease_expires = ? WHERE id = ?",
+                (now, self.owner, now + self.lease, row["id"]),
+            )
+            blobs = {
+                blob["name"]: blob["data"]
+                for blob in conn.execute(
+                    "SELECT name, data FROM job_blobs WHERE job_id = ?", (row["id"],)
+                )
+            }
+            conn.execute("COMMIT")
+            params = json.loads(row["params"])
+            return row["id"], row["kind"], params, row["attempts"], blobs
+
+    def _finish(self, job_id, result=None, error=None):
+        # Serialize before the transaction so a bad result cannot leave it open
+        result_json = json.dumps(result) if error is None else None
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                "lease_expires = NULL WHERE id = ? AND owner = ? AND status = 'running'",
+                (
+                    "failed" if error is not None else "done",
+                    result_json,
+                    error,
+                    time.time(),
+                    job_id,
+                    self.owner,
+                ),
+            ).rowcount
+            if not updated:
+                conn.execute("COMMIT")
+                logger.warning(f"Job {job_id} lost its lease; result discarded")
+                return
+            conn.execute("DELETE FROM job_blobs WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+
+    def _heartbeat(self):
+        """Extend the lease of the jobs this process is running."""
+        # Separate from _wakeup so submit() never wakes this thread instead of a worker
+        while not self._stopped.wait(timeout=self.lease / 3):
+            with self._active_lock:
+                active = list(self._active)
+            if not active:
+                continue
+
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET lease_expires = ? WHERE owner = ? "
+                        "AND status = 'running' AND id IN "
+                        f"({', '.join('?' for _ in active)})",
+                        (time.time() + self.lease, self.owner, *active),
+                    )
+            except Exception as e:
+                logger.error(f"Job heartbeat failed: {type(e).__name__}: {str(e)}")
+
+    def _run_next(self):
+        """Claim and run one job; returns False when the queue is empty."""
+        claimed = self._claim()
+        if claimed is None:
+            return False
+
+        job_id, kind, params, attempts, blobs = claimed
+        with self._active_lock:
+            self._active.add(job_id)
+        try:
+            if attempts >= self.max_attempts:
+                self._finish(job_id, error="Job interrupted too many times")
+                return True
+
+            logger.info(f"Running job {job_id} ({kind})")
+            try:
+                result = self.handlers[kind](params, blobs)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {type(e).__name__}: {str(e)}")
+                self._finish(job_id, error=str(e))
+                return True
+
+            try:
+                self._finish(job_id, result=result)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Job {job_id} returned an unserializable result")
+                self._finish(job_id, error=f"Invalid job result: {str(e)}")
+                return True
+            logger.info(f"Job {job_id} done")
+            return True
+        finally:
+            # A job left running after an error is requeued once its lease expires
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+
+            try:
+                if time.time() - self._last_maintenance >= self.maintenance_interval:
+                    self._maintain()
+                ran = self._run_next()
+                idle_wait = min(5, self.maintenance_interval)
+            except Exception:
+                logger.exception("Job worker error; backing off")
+                ran = False
+                idle_wait = 1
+
+            if not ran:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(timeout=idle_wait)
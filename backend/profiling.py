@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Request Profiling
+Samples the Python stack of the thread running an analysis at a fixed
+interval, then keeps the profile when the run was slower than a threshold
+or profiling was explicitly requested. torch operator timings, which cost
+far more than stack sampling, are recorded only for requested runs and for
+a configurable fraction of the others.
+
+Stacks are written in the collapsed ("folded") format read by flamegraph.pl,
+speedscope and inferno; torch op timings are stored alongside in JSON.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+_PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+# Operators kept in the profile metadata, by self CPU time
+TOP_TORCH_OPS = 30
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """Background thread counting the stacks of one target thread."""
+
+    def __init__(self, target_ident, interval):
+        super().__init__(daemon=True)
+        self.target_ident = target_ident
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            folded = ";".join(reversed(stack))
+            self.counts[folded] = self.counts.get(folded, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class SamplingProfiler:
+    """
+    Threshold-triggered profiler with an on-disk ring of recent profiles.
+
+    Args:
+        directory: Where profiles are written
+        threshold_ms: Keep profiles of runs slower than this; None samples
+            only runs that are explicitly forced
+        interval_ms: Stack sampling interval
+        keep: Number of most recent profiles retained
+        torch_sample_rate: Fraction of threshold-sampled runs that also
+            record torch operator timings (forced runs always do)
+    """
+
+    def __init__(
+        self,
+        directory,
+        threshold_ms=None,
+        interval_ms=5,
+        keep=20,
+        torch_sample_rate=0.0,
+    ):
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self.torch_sample_rate = torch_sample_rate
+        # torch supports one active profiler at a time across threads
+        self._torch_lock = threading.Lock()
+        self._files_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self, fn, force=False, label="analyze"):
+        """
+        Call ``fn()`` in the current thread, profiling it if enabled.
+
+        Args:
+            fn: Zero-argument callable to run
+            force: Profile and keep the result regardless of the threshold
+            label: Name recorded in the profile metadata
+
+        Returns:
+            Tuple of (fn's result, profile_id or None)
+        """
+        if self.threshold_ms is None and not force:
+            return fn(), None
+
+        sampler = _StackSampler(threading.get_ident(), self.interval)
+        torch_profile = None
+        record_ops = force or random.random() < self.torch_sample_rate
+        if record_ops and self._torch_lock.acquire(blocking=False):
+            torch_profile = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU]
+            )
+
+        def timed():
+            # Excludes profiler start-up from the measured duration
+            start = time.perf_counter()
+            result = fn()
+            return result, (time.perf_counter() - start) * 1000
+
+        sampler.start()
+        try:
+            if torch_profile is not None:
+                try:
+                    with torch_profile:
+                        result, duration_ms = timed()
+                finally:
+                    self._torch_lock.release()
+            else:
+                result, duration_ms = timed()
+        finally:
+            sampler.stop()
+
+        if force:
+            reason = "requested"
+        elif duration_ms > self.threshold_ms:
+            reason = "threshold"
+        else:
+            return result, None
+
+        try:
+            profile_id = self._save(label, reason, duration_ms, sampler, torch_profile)
+        except Exception as e:
+            logger.error(f"Failed to save profile: {str(e)}")
+            return result, None
+
+        logger.info(
+            f"Saved {label} profile {profile_id} ({reason}, {duration_ms:.0f} ms, "
+            f"{sampler.samples} samples)"
+        )
+        return result, profile_id
+
+    def _save(self, label, reason, duration_ms, sampler, torch_profile):
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+
+        torch_ops = []
+        if torch_profile is not None:
+            events = sorted(
+                torch_profile.key_averages(),
+                key=lambda event: event.self_cpu_time_total,
+                reverse=True,
+            )
+            torch_ops = [
+                {
+                    "name": event.key,
+                    "calls": event.count,
+                    "self_cpu_ms": round(event.self_cpu_time_total / 1000, 3),
+                    "cpu_total_ms": round(event.cpu_time_total / 1000, 3),
+                }
+                for event in events[:TOP_TORCH_OPS]
+            ]
+
+        metadata = {
+            "id": profile_id,
+            "label": label,
+            "reason": reason,
+            "created_at": time.time(),
+            "duration_ms": round(duration_ms, 1),
+            "threshold_ms": self.threshold_ms,
+            "interval_ms": self.interval * 1000,
+            "samples": sampler.samples,
+            "torch_ops": torch_ops,
+        }
+
+        with self._files_lock:
+            with open(os.path.join(self.directory, f"{profile_id}.folded"), "w") as f:
+                for stack, count in sorted(sampler.counts.items()):
+                    f.write(f"{stack} {count}\n")
+            with open(os.path.join(self.directory, f"{profile_id}.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+
+            for old_id in self._profile_ids()[self.keep :]:
+                for ext in (".json", ".folded"):
+                    path = os.path.join(self.directory, old_id + ext)
+                    if os.path.exists(path):
+                        os.unlink(path)
+
+        return profile_id
+
+    def _profile_ids(self):
+        """Stored profile IDs, newest first."""
+        ids = [
+            name[: -len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json") and _PROFILE_ID.match(name[: -len(".json")])
+        ]
+        return sorted(
+            ids, key=lambda profile_id: int(profile_id.split("-")[0]), reverse=True
+        )
+
+    def list_profiles(self):
+        """Metadata of the stored profiles, newest first, without op timings."""
+        profiles = []
+        for profile_id in self._profile_ids():
+            metadata = self.get_metadata(profile_id)
+            if metadata is not None:
+                metadata.pop("torch_ops", None)
+                profiles.append(metadata)
+        return profiles
+
+    def get_metadata(self, profile_id):
+        """Return a profile's metadata, or None if it does not exist."""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def folded_path(self, profile_id):
+        """Return the path of a profile's folded stacks, or None."""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.folded")
+        return path if os.path.exists(path) else None
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+User Progress Store
+Keeps every analysed attempt per user in SQLite (WAL mode) together with
+running aggregates that are updated in O(1) per attempt, so progress can be
+served without rescanning a user's history.
+
+Attempts in which no /s/ was scored (e.g. a take that stopped early) are
+stored and counted but leave every rate untouched.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+LISP_TYPES = ["interdental", "palatal", "lateral", "dentalized"]
+
+# Weight of the newest attempt in the rolling (exponential moving average) rates
+ROLLING_ALPHA = 0.2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    phrase_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    lisp_analysis TEXT NOT NULL,
+    sibilants TEXT NOT NULL,
+    truth_transcription TEXT,
+    recorded_transcription TEXT
+);
+CREATE INDEX IF NOT EXISTS attempts_user ON attempts (user_id, created_at);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    sibilants INTEGER NOT NULL,
+    interdental INTEGER NOT NULL,
+    palatal INTEGER NOT NULL,
+    lateral INTEGER NOT NULL,
+    dentalized INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    rolling_interdental REAL NOT NULL,
+    rolling_palatal REAL NOT NULL,
+    rolling_lateral REAL NOT NULL,
+    rolling_dentalized REAL NOT NULL,
+    rolling_total REAL NOT NULL,
+    last_attempt_at REAL NOT NULL,
+    scored_attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS phrase_stats (
+    user_id TEXT NOT NULL,
+    phrase_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    first_rate REAL NOT NULL,
+    last_rate REAL NOT NULL,
+    best_rate REAL NOT NULL,
+    rolling_rate REAL NOT NULL,
+    last_attempt_at REAL NOT NULL,
+    scored_attempts INTEGER NOT NULL DEFAULT 0,
+    sibilants INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, phrase_id)
+);
+"""
+
+# Columns added after the first release: (table, column, definition, backfill)
+_MIGRATIONS = [
+    # Every earlier attempt was folded into the rates, so count it as scored
+    ("user_stats", "scored_attempts", "INTEGER NOT NULL DEFAULT 0", "attempts"),
+    ("phrase_stats", "scored_attempts", "INTEGER NOT NULL DEFAULT 0", "attempts"),
+    ("phrase_stats", "sibilants", "INTEGER NOT NULL DEFAULT 0", None),
+]
+
+
+def _rates(lisp_analysis, num_sibilants):
+    """Per-attempt lisp rates: occurrences of each type per /s/ scored."""
+    scored = max(num_sibilants, 1)
+    rates = {lisp: lisp_analysis.get(lisp, 0) / scored for lisp in LISP_TYPES}
+    rates["total"] = lisp_analysis.get("total", 0) / scored
+    return rates
+
+
+def _phrase_progress(phrase):
+    """Per-phrase aggregates; rates are None until a scored attempt."""
+    scored = phrase["scored_attempts"] > 0
+    return {
+        "attempts": phrase["attempts"],
+        "scored_attempts": phrase["scored_attempts"],
+        "sibilants_scored": phrase["sibilants"],
+        "first_rate": phrase["first_rate"] if scored else None,
+        "last_rate": phrase["last_rate"] if scored else None,
+        "best_rate": phrase["best_rate"] if scored else None,
+        "rolling_rate": phrase["rolling_rate"] if scored else None,
+        "improvement": (
+            phrase["first_rate"] - phrase["rolling_rate"] if scored else None
+        ),
+        "last_attempt_at": phrase["last_attempt_at"],
+    }
+
+
+class ProgressStore:
+    """
+    Per-user attempt history and incremental aggregates.
+
+    Args:
+        db_path: SQLite database file
+        alpha: Weight of the newest attempt in the rolling rates
+    """
+
+    def __init__(self, db_path, alpha=ROLLING_ALPHA):
+        self.db_path = db_path
+        self.alpha = alpha
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            for table, column, definition, backfill in _MIGRATIONS:
+                columns = {
+                    row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+                }
+                if column not in columns:
+                    conn.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                    )
+                    if backfill:
+                        conn.execute(f"UPDATE {table} SET {column} = {backfill}")
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            # Closing without COMMIT rolls back a failed transaction
+            conn.close()
+
+    def record_attempt(self, user_id, phrase_id, result):
+        """
+        Store one analysis result and fold it into the user's aggregates.
+
+        Args:
+            user_id: User the attempt belongs to
+            phrase_id: Reference phrase (truth_id) that was practised
+            result: analyze_speech result
+        """
+        lisp_analysis = result["lisp_analysis"]
+        sibilants = result.get("sibilants", [])
+        rates = _rates(lisp_analysis, len(sibilants))
+        # An attempt without a scored /s/ has no rate to fold in
+        scored = 1 if sibilants else 0
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO attempts (user_id, phrase_id, created_at, lisp_analysis, "
+                "sibilants, truth_transcription, recorded_transcription) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    phrase_id,
+                    now,
+                    json.dumps(lisp_analysis),
+                    json.dumps(sibilants),
+                    result.get("truth_transcription"),
+                    result.get("recorded_transcription"),
+                ),
+            )
+
+            # The first scored attempt seeds the rolling rates with its own
+            # rates; unscored attempts keep the previous rates
+            rolling_updates = ", ".join(
+                f"rolling_{lisp} = CASE "
+                f"WHEN excluded.scored_attempts = 0 THEN rolling_{lisp} "
+                f"WHEN scored_attempts = 0 THEN excluded.rolling_{lisp} "
+                f"ELSE (1 - :alpha) * rolling_{lisp} "
+                f"+ :alpha * excluded.rolling_{lisp} END"
+                for lisp in LISP_TYPES + ["total"]
+            )
+            count_updates = ", ".join(
+                f"{lisp} = {lisp} + excluded.{lisp}" for lisp in LISP_TYPES + ["total"]
+            )
+            conn.execute(
+                "INSERT INTO user_stats (user_id, attempts, scored_attempts, "
+                "sibilants, interdental, palatal, lateral, dentalized, total, "
+                "rolling_interdental, rolling_palatal, rolling_lateral, "
+                "rolling_dentalized, rolling_total, last_attempt_at) "
+                "VALUES (:user_id, 1, :scored, :sibilants, "
+                ":interdental, :palatal, :lateral, :dentalized, :total, "
+                ":rate_interdental, :rate_palatal, :rate_lateral, "
+                ":rate_dentalized, :rate_total, :now) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "attempts = attempts + 1, "
+                "scored_attempts = scored_attempts + excluded.scored_attempts, "
+                "sibilants = sibilants + excluded.sibilants, "
+                f"{count_updates}, {rolling_updates}, "
+                "last_attempt_at = excluded.last_attempt_at",
+                {
+                    "user_id": user_id,
+                    "scored": scored,
+                    "sibilants": len(sibilants),
+                    "total": lisp_analysis.get("total", 0),
+                    "rate_total": rates["total"],
+                    "now": now,
+                    "alpha": self.alpha,
+                    **{lisp: lisp_analysis.get(lisp, 0) for lisp in LISP_TYPES},
+                    **{f"rate_{lisp}": rates[lisp] for lisp in LISP_TYPES},
+                },
+            )
+
+            conn.execute(
+                "INSERT INTO phrase_stats (user_id, phrase_id, attempts, "
+                "scored_attempts, sibilants, first_rate, last_rate, best_rate, "
+                "rolling_rate, last_attempt_at) VALUES (:user_id, :phrase_id, 1, "
+                ":scored, :sibilants, :rate, :rate, :rate, :rate, :now) "
+                "ON CONFLICT (user_id, phrase_id) DO UPDATE SET "
+                "attempts = attempts + 1, "
+                "scored_attempts = scored_attempts + excluded.scored_attempts, "
+                "sibilants = sibilants + excluded.sibilants, "
+                "first_rate = CASE WHEN scored_attempts = 0 "
+                "THEN excluded.first_rate ELSE first_rate END, "
+                "last_rate = CASE WHEN excluded.scored_attempts = 0 "
+                "THEN last_rate ELSE excluded.last_rate END, "
+                "best_rate = CASE WHEN excluded.scored_attempts = 0 THEN best_rate "
+                "WHEN scored_attempts = 0 THEN excluded.best_rate "
+                "ELSE MIN(best_rate, excluded.best_rate) END, "
+                "rolling_rate = CASE WHEN excluded.scored_attempts = 0 THEN rolling_rate "
+                "WHEN scored_attempts = 0 THEN excluded.rolling_rate "
+                "ELSE (1 - :alpha) * rolling_rate + :alpha * excluded.rolling_rate END, "
+                "last_attempt_at = excluded.last_attempt_at",
+                {
+                    "user_id": user_id,
+                    "phrase_id": phrase_id,
+                    "scored": scored,
+                    "sibilants": len(sibilants),
+                    "rate": rates["total"],
+                    "now": now,
+                    "alpha": self.alpha,
+                },
+            )
+            conn.execute("COMMIT")
+
+    def get_progress(self, user_id):
+        """
+        Return a user's aggregates, or None if they have no attempts.
+
+        Per-phrase ``improvement`` is the drop in lisp rate from the first
+        scored attempt to the rolling rate (positive means fewer lisps).
+        Rates are None until an attempt has a scored /s/.
+        """
+        with self._connect() as conn:
+            user = conn.execute(
+                "SELECT * FROM user_stats WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if user is None:
+                return None
+            phrases = conn.execute(
+                "SELECT * FROM phrase_stats WHERE user_id = ? ORDER BY phrase_id",
+                (user_id,),
+            ).fetchall()
+
+        return {
+            "user_id": user_id,
+            "attempts": user["attempts"],
+            "scored_attempts": user["scored_attempts"],
+            "sibilants_scored": user["sibilants"],
+            "lisp_counts": {lisp: user[lisp] for lisp in LISP_TYPES + ["total"]},
+            "rolling_rates": (
+                {lisp: user[f"rolling_{lisp}"] for lisp in LISP_TYPES + ["total"]}
+                if user["scored_attempts"]
+                else None
+            ),
+            "last_attempt_at": user["last_attempt_at"],
+            "phrases": {
+                phrase["phrase_id"]: _phrase_progress(phrase) for phrase in phrases
+            },
+        }
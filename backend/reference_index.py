@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Reference Phrase Index
+Precomputes, for every known mission phrase, the CTC alignment targets,
+the expected /s/ positions and the expected acoustic feature ranges so that
+a recording can be scored without running the model on the truth audio.
+
+Build offline with:
+    python reference_index.py build [--audio-dir sound_samples/references]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Known reference phrases, keyed by the truth_id clients send to /analyze;
+# level_N is the phrase of mission N (OnboardingScreens/Home/Game/Game.service.ts)
+REFERENCE_PHRASES = {
+    "sally_sells": "Sally sells sea shells by the sea shore.",
+    "sally_sells_paragraph": "Sally sells sea shells by the sea shore. She sells sea shells surely. The shells she sells are surely sea shells. So if she sells shells on the seashore, I'm sure she sells seashore shells.",
+    "level_1": "Sally sells sea shells by the sea shore",
+    "level_2": "see, sip, sue",
+    "level_3": "Now: past, list, fast, toast.",
+    "level_4": "Sam sings softly at sunrise.",
+    "level_5": "Sarah sells small seashells on the sunny shore.",
+}
+
+# Exact texts the app sends to /tts/generate with a clone's voice_id, one per
+# mission level (levelTexts in OnboardingScreens/Home/Game/Game.service.ts);
+# pre-rendered for new clones, so keep them in sync with the client
+MISSION_PROMPTS = [
+    "Repeat after me cadet!: Sally sells sea shells by the sea shore",
+    "Repeat after me cadet!: see, sip, sue",
+    "Repeat after me cadet!: Now: past, list, fast, toast.",
+    "Repeat after me cadet!: Sam sings softly at sunrise.",
+    "Repeat after me cadet!: Sarah sells small seashells on the sunny shore.",
+]
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(__file__), "reference_index.json")
+
+INDEX_VERSION = 2
+
+# Spectral ranges of a well-formed /s/ (matches the "normal" band used by
+# classify_acoustic_lisp); used when no reference recording was measured
+DEFAULT_FEATURE_RANGES = {
+    "centroid": [6000.0, 9000.0],
+}
+
+# Letters after which a word-final "s" is voiced (/z/), e.g. "sells", "shells"
+_VOICED_BEFORE_FINAL_S = set("AEIOUBDGLMNRVWY")
+
+
+def normalize_text(text):
+    """Normalize text into the wav2vec2 character vocabulary (A-Z, ', |)."""
+    words = []
+    for word in text.upper().split():
+        cleaned = "".join(c for c in word if c.isalpha() or c == "'")
+        if cleaned:
+            words.append(cleaned)
+    return "|".join(words)
+
+
+def phonemize(normalized):
+    """
+    Rough grapheme-to-phoneme labelling focused on sibilants.
+
+    wav2vec2-base-960h emits characters, so the alignment targets stay
+    characters; this labels each target character with the phoneme it
+    realises: "S" for /s/, "Z" for /z/, "SH" for /sh/, "-" for letters
+    absorbed by a previous phoneme, and the letter itself otherwise.
+
+    Returns:
+        list: One phoneme label per character of ``normalized``
+    """
+    labels = []
+    n = len(normalized)
+    i = 0
+    while i < n:
+        char = normalized[i]
+        nxt = normalized[i + 1] if i + 1 < n else "|"
+        prev = normalized[i - 1] if i > 0 else "|"
+
+        if char == "S" and nxt == "H":
+            labels.extend(["SH", "-"])
+            i += 2
+            continue
+        if char == "S" and nxt == "S":
+            labels.extend(["S", "-"])
+            i += 2
+            continue
+        if char == "S":
+            if nxt == "|" and prev in _VOICED_BEFORE_FINAL_S:
+                labels.append("Z")
+            else:
+                labels.append("S")
+        elif char == "C" and nxt in "EIY":
+            labels.append("S")
+        elif char == "|":
+            labels.append("|")
+        else:
+            labels.append(char)
+        i += 1
+
+    return labels
+
+
+def sibilant_spans(phonemes):
+    """
+    Find the /s/ occurrences in a phoneme labelling.
+
+    Returns:
+        list: (first_target_index, last_target_index) per /s/ occurrence
+    """
+    spans = []
+    for i, label in enumerate(phonemes):
+        if label != "S":
+            continue
+        end = i
+        while end + 1 < len(phonemes) and phonemes[end + 1] == "-":
+            end += 1
+        spans.append((i, end))
+    return spans
+
+
+def build_reference_entry(text, tokenizer):
+    """
+    Build the index entry for one phrase from its text alone.
+
+    Args:
+        text: Reference phrase
+        tokenizer: wav2vec2 CTC tokenizer (processor.tokenizer)
+
+    Returns:
+        Dictionary with text, targets, phonemes, /s/ spans and feature ranges
+    """
+    normalized = normalize_text(text)
+    vocab = tokenizer.get_vocab()
+    unk_id = vocab.get(tokenizer.unk_token)
+    targets = [vocab.get(c, unk_id) for c in normalized]
+    phonemes = phonemize(normalized)
+    spans = sibilant_spans(phonemes)
+
+    return {
+        "text": text,
+        "normalized": normalized,
+        "targets": targets,
+        "phonemes": phonemes,
+        "s_spans": [list(span) for span in spans],
+        "feature_ranges": [dict(DEFAULT_FEATURE_RANGES) for _ in spans],
+        "audio_sha256": None,
+    }
+
+
+def measure_reference_audio(entry, audio_path, margin=0.15):
+    """
+    Align a reference recording to its entry and store the measured /s/
+    feature ranges (measured value +/- ``margin``) in place.
+    """
+    from analyze_speech import (
+        get_model,
+        load_audio,
+        get_transcription,
+        ctc_forced_align,
+        find_sibilant_regions,
+        extract_acoustic_features,
+    )
+    import torch
+
+    processor, model, device = get_model()
+    audio, sr = load_audio(audio_path)
+    _, logits = get_transcription(audio, processor, model, device)
+    log_probs = torch.log_softmax(logits, dim=-1).cpu()
+
+    alignment, frame_log_probs = ctc_forced_align(
+        log_probs, [entry["targets"]], blank=processor.tokenizer.pad_token_id
+    )
+    regions = find_sibilant_regions(
+        alignment[0], frame_log_probs[0], entry["s_spans"], sr
+    )
+
+    for i, region in enumerate(regions):
+        features = extract_acoustic_features(audio, sr, region["start"], region["end"])
+        if features is None:
+            continue
+        centroid = float(features["centroid"])
+        entry["feature_ranges"][i] = {
+            "centroid": [centroid * (1 - margin), centroid * (1 + margin)],
+        }
+
+    with open(audio_path, "rb") as f:
+        entry["audio_sha256"] = hashlib.sha256(f.read()).hexdigest()
+
+
+def build_reference_index(output_path=DEFAULT_INDEX_PATH, audio_dir=None):
+    """
+    Build the reference index for REFERENCE_PHRASES and write it as JSON.
+
+    Args:
+        output_path: Where to write the index
+        audio_dir: Optional directory holding ``<truth_id>.mp3`` reference
+            recordings; when present their /s/ features are measured
+
+    Returns:
+        dict: The index that was written
+    """
+    from analyze_speech import get_model
+
+    processor, _, _ = get_model()
+    phrases = {}
+
+    for truth_id, text in REFERENCE_PHRASES.items():
+        entry = build_reference_entry(text, processor.tokenizer)
+        if audio_dir:
+            audio_path = os.path.join(audio_dir, f"{truth_id}.mp3")
+            if os.path.exists(audio_path):
+                measure_reference_audio(entry, audio_path)
+        phrases[truth_id] = entry
+
+    index = {
+        "version": INDEX_VERSION,
+        "blank_id": processor.tokenizer.pad_token_id,
+        "phrases": phrases,
+    }
+
+    with open(output_path, "w") as f:
+        json.dump(index, f, indent=2)
+
+    return index
+
+
+# Global cache for the loaded index
+_INDEX_CACHE = {}
+
+# Entries built from uploaded truth audio, keyed by the audio's sha256
+LEARNED_REFERENCES_MAX = 256
+_LEARNED = OrderedDict()
+_LEARNED_LOCK = threading.Lock()
+
+
+def build_text_index(tokenizer):
+    """Build an in-memory index of text-only entries for REFERENCE_PHRASES."""
+    return {
+        "version": INDEX_VERSION,
+        "blank_id": tokenizer.pad_token_id,
+        "phrases": {
+            truth_id: build_reference_entry(text, tokenizer)
+            for truth_id, text in REFERENCE_PHRASES.items()
+        },
+    }
+
+
+def load_reference_index(path=DEFAULT_INDEX_PATH, tokenizer=None):
+    """
+    Load and cache the reference index.
+
+    When the index file was not built (or is outdated) and a tokenizer is
+    given, text-only entries are built from REFERENCE_PHRASES instead.
+
+    Returns:
+        dict, or None if there is no index file and no tokenizer
+    """
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    if path not in _INDEX_CACHE:
+        index = None
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("version") != INDEX_VERSION:
+                logger.warning(
+                    f"Ignoring reference index with version {index.get('version')}"
+                )
+                index = None
+        else:
+            logger.warning(f"Reference index not found: {path}")
+
+        if index is None:
+            if tokenizer is None:
+                return None
+            logger.info("Building text-only reference index from REFERENCE_PHRASES")
+            index = build_text_index(tokenizer)
+
+        index["by_sha256"] = {
+            entry["audio_sha256"]: truth_id
+            for truth_id, entry in index["phrases"].items()
+            if entry.get("audio_sha256")
+        }
+        _INDEX_CACHE[path] = index
+        logger.info(f"Loaded reference index with {len(index['phrases'])} phrases")
+
+    return _INDEX_CACHE[path]
+
+
+def _audio_sha256(truth_path):
+    """Content hash of truth audio given as a path or container bytes."""
+    if isinstance(truth_path, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(truth_path).hexdigest()
+    with open(truth_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_reference(truth_id=None, truth_path=None, tokenizer=None):
+    """
+    Look up a precomputed reference by truth_id, or by the content hash of
+    the truth audio (a path or container bytes) when the client uploaded a
+    known reference clip or truth audio that was already transcribed.
+    """
+    index = load_reference_index(tokenizer=tokenizer)
+
+    if truth_id is not None:
+        return index["phrases"].get(truth_id) if index is not None else None
+
+    if truth_path is None:
+        return None
+
+    sha256 = _audio_sha256(truth_path)
+    if index is not None and sha256 in index["by_sha256"]:
+        return index["phrases"][index["by_sha256"][sha256]]
+
+    with _LEARNED_LOCK:
+        entry = _LEARNED.get(sha256)
+        if entry is not None:
+            _LEARNED.move_to_end(sha256)
+        return entry
+
+
+def remember_reference(truth_path, entry):
+    """
+    Keep an entry built from truth audio so the same audio is not run
+    through the model again (e.g. the same TTS clip sent on every attempt).
+    """
+    sha256 = _audio_sha256(truth_path)
+    with _LEARNED_LOCK:
+        _LEARNED[sha256] = entry
+        _LEARNED.move_to_end(sha256)
+        while len(_LEARNED) > LEARNED_REFERENCES_MAX:
+            _LEARNED.popitem(last=False)
+
+
+def main():
+    """Command line interface"""
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("Usage: python reference_index.py build [--audio-dir DIR]")
+        sys.exit(1)
+
+    audio_dir = None
+    if "--audio-dir" in sys.argv:
+        audio_dir = sys.argv[sys.argv.index("--audio-dir") + 1]
+
+    index = build_reference_index(audio_dir=audio_dir)
+    print(f"Wrote {len(index['phrases'])} phrases to {DEFAULT_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    main()
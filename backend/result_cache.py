@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Analysis Result Cache
+Idempotency and result cache for /analyze: identical submissions (or
+retries carrying the same Idempotency-Key) reuse the stored result, and
+concurrent duplicates wait on the computation already in flight.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different payload."""
+
+
+def make_cache_key(recorded_bytes, truth_bytes=None, truth_id=None, options=None):
+    """
+    Hash everything that determines an analysis result.
+
+    Args:
+        recorded_bytes: Recorded audio bytes
+        truth_bytes: Truth audio bytes (if the client uploaded them)
+        truth_id: Reference phrase ID (if the client sent one)
+        options: Dict of pipeline version and other options that affect the result
+
+    Returns:
+        str: Hex digest identifying the submission
+    """
+    digest = hashlib.sha256()
+    for part in (
+        truth_id or "",
+        hashlib.sha256(truth_bytes or b"").hexdigest(),
+        hashlib.sha256(recorded_bytes).hexdigest(),
+        repr(sorted((options or {}).items())),
+    ):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of results with a TTL.
+
+    ``get_or_compute`` is meant to be awaited from the event loop; the
+    compute callable is an async function run at most once per key at a time.
+    """
+
+    def __init__(self, ttl=600, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._results = OrderedDict()  # key -> (expires_at, result)
+        self._idempotency = OrderedDict()  # idempotency key -> (expires_at, key)
+        self._in_flight = {}  # key -> asyncio.Future
+
+    def _prune(self, now):
+        for store in (self._results, self._idempotency):
+            while store and next(iter(store.values()))[0] <= now:
+                store.popitem(last=False)
+            while len(store) > self.max_entries:
+                store.popitem(last=False)
+
+    def get(self, key):
+        """Return a cached result or None."""
+        now = time.monotonic()
+        entry = self._results.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        self._results.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, result):
+        """Store a result, evicting the least recently used entries."""
+        now = time.monotonic()
+        self._results.pop(key, None)
+        self._results[key] = (now + self.ttl, result)
+        self._prune(now)
+
+    def resolve_idempotency_key(self, idempotency_key, key):
+        """
+        Bind an Idempotency-Key to a payload key.
+
+        Raises:
+            IdempotencyConflict: If the key was already used for another payload
+        """
+        now = time.monotonic()
+        entry = self._idempotency.get(idempotency_key)
+        if entry is not None and entry[0] > now and entry[1] != key:
+            raise IdempotencyConflict(
+                f"Idempotency-Key {idempotency_key} was used with a different payload"
+            )
+        self._idempotency.pop(idempotency_key, None)
+        self._idempotency[idempotency_key] = (now + self.ttl, key)
+        self._prune(now)
+
+    async def get_or_compute(self, key, compute):
+        """
+        Return the cached result for ``key``, or await ``compute()`` once.
+
+        Returns:
+            Tuple of (result, status) where status is "hit", "wait" or "miss"
+        """
+        # A cache sized to zero is disabled, including request coalescing
+        if self.max_entries <= 0:
+            return await compute(), "miss"
+
+        result = self.get(key)
+        if result is not None:
+            return result, "hit"
+
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key]), "wait"
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged as lost
+            future.exception()
+            raise
+        else:
+            self.put(key, result)
+            future.set_result(result)
+            return result, "miss"
+        finally:
+            del self._in_flight[key]
@@ -1,10 +1,36 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body
-from fastapi.responses import Response
+from fastapi import (
+    FastAPI,
+    File,
+    UploadFile,
+    HTTPException,
+    Form,
+    Body,
+    Header,
+    BackgroundTasks,
+)
+from fastapi.responses import Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import tempfile
 import os
-from analyze_speech import analyze_speech
-from tts import tts, stitch_audios, stitch_audio_bytes, generate_clone
+from functools import partial
+from analyze_speech import analyze_speech, PIPELINE_VERSION
+from result_cache import ResultCache, IdempotencyConflict, make_cache_key
+from job_queue import JobQueue, JobConflict
+from progress_store import ProgressStore
+from audio_container import EXTENSION as CONTAINER_EXTENSION, validate_container
+from clone_registry import CloneRegistry
+from profiling import SamplingProfiler
+from reference_index import MISSION_PROMPTS, REFERENCE_PHRASES
+from tts import (
+    tts,
+    stitch_audios,
+    stitch_audio_bytes,
+    generate_clone,
+    prerender_tts,
+    tts_cache_path,
+    is_valid_voice_id,
+)
 import logging
 from typing import List, Optional
 
@@ -18,6 +44,48 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Result cache for repeated /analyze submissions
+result_cache = ResultCache(
+    ttl=int(os.getenv("ANALYZE_CACHE_TTL", "600")),
+    max_entries=int(os.getenv("ANALYZE_CACHE_SIZE", "256")),
+)
+
+# Per-user attempt history and progress aggregates
+progress_store = ProgressStore(
+    os.getenv("PROGRESS_DB", os.path.join(os.path.dirname(__file__), "progress.db"))
+)
+
+# Voice clones already created, keyed by sample hash and fingerprint
+clone_registry = CloneRegistry(
+    os.getenv(
+        "CLONE_REGISTRY_DB", os.path.join(os.path.dirname(__file__), "voice_clones.db")
+    )
+)
+
+# Persistent queue for /analyze/jobs
+job_queue = JobQueue(
+    os.getenv(
+        "ANALYZE_JOB_DB", os.path.join(os.path.dirname(__file__), "analyze_jobs.db")
+    ),
+    handlers={"analyze": lambda params, blobs: run_analysis_job(params, blobs)},
+    workers=int(os.getenv("ANALYZE_JOB_WORKERS", "1")),
+    dedup_window=int(os.getenv("ANALYZE_CACHE_TTL", "600")),
+)
+
+# Sampled profiles of slow or explicitly profiled /analyze runs
+profiler = SamplingProfiler(
+    os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles")),
+    threshold_ms=(
+        float(os.environ["PROFILE_THRESHOLD_MS"])
+        if os.getenv("PROFILE_THRESHOLD_MS")
+        else None
+    ),
+    interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+    keep=int(os.getenv("PROFILE_KEEP", "20")),
+    torch_sample_rate=float(os.getenv("PROFILE_TORCH_SAMPLE_RATE", "0")),
+)
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+
 # CORS middleware for React Native
 app.add_middleware(
     CORSMiddleware,
@@ -30,13 +98,47 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup_event():
-    """Pre-load the model on server startup"""
-    from analyze_speech import get_model
+    """Pre-load the model and reference index on server startup"""
+    from analyze_speech import get_model, load_audio
+    from reference_index import load_reference_index
+    from inference_tuning import (
+        autotune,
+        load_persisted_inter_op_threads,
+        set_concurrency,
+    )
+
+    # Must run before torch does any parallel work
+    load_persisted_inter_op_threads()
 
     logger.info("Pre-loading wav2vec2 model...")
-    get_model()
+    processor, model, device = get_model()
     logger.info("Model loaded and ready")
 
+    concurrency = int(os.getenv("INFERENCE_CONCURRENCY", "2"))
+    if os.getenv("INFERENCE_AUTOTUNE", "1") == "1":
+        sample, sr = load_audio(
+            os.path.join(os.path.dirname(__file__), "sound_samples", "test_phrase.mp3")
+        )
+        input_values = processor(
+            sample, sampling_rate=sr, return_tensors="pt"
+        ).input_values
+        await run_in_threadpool(
+            autotune, model, device, input_values, concurrency=concurrency
+        )
+    else:
+        set_concurrency(device, concurrency)
+
+    logger.info("Loading reference index...")
+    load_reference_index(tokenizer=processor.tokenizer)
+
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Let analysis workers finish their current job"""
+    job_queue.stop(timeout=30)
+
 
 @app.get("/")
 async def root():
@@ -50,6 +152,14 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/diagnostics")
+async def diagnostics():
+    """Inference configuration in effect, including the autotuning results"""
+    from inference_tuning import current_settings
+
+    return {"inference": current_settings()}
+
+
 @app.get("/audio/{filename}")
 async def serve_audio_file(filename: str):
     """
@@ -82,8 +192,200 @@ async def serve_audio_file(filename: str):
         )
 
 
+def _write_temp_audio(audio_bytes, ext, label):
+    """Write audio bytes to a temp file, converting m4a to wav for librosa."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+        path = tmp.name
+        logger.info(f"Writing {len(audio_bytes)} {label} bytes to: {path}")
+        tmp.write(audio_bytes)
+        tmp.flush()
+
+    if os.path.getsize(path) == 0:
+        os.unlink(path)
+        raise Exception(f"{label.capitalize()} audio file is empty: {path}")
+
+    if ext == ".m4a":
+        logger.info(f"Converting {label} m4a to wav...")
+        from pydub import AudioSegment
+
+        try:
+            audio = AudioSegment.from_file(path, format="m4a")
+            new_path = path.replace(".m4a", ".wav")
+            audio.export(new_path, format="wav")
+        finally:
+            # Clean up old m4a file
+            os.unlink(path)
+        path = new_path
+        logger.info(f"Converted {label} to wav: {path}")
+
+    return path
+
+
+def run_analysis(
+    recorded_bytes, recorded_ext, truth_bytes=None, truth_ext=None, truth_id=None
+):
+    """
+    Run analyze_speech on in-memory audio, using temp files for decoding.
+
+    Blocking; call it from a worker thread. Audio containers are passed to
+    analyze_speech in memory without a temp file.
+    """
+    truth_path = None
+    recorded_path = None
+    temp_paths = []
+
+    try:
+        if truth_bytes is not None and truth_ext == CONTAINER_EXTENSION:
+            truth_path = truth_bytes
+        elif truth_bytes is not None:
+            truth_path = _write_temp_audio(truth_bytes, truth_ext, "truth")
+            temp_paths.append(truth_path)
+
+        if recorded_ext == CONTAINER_EXTENSION:
+            recorded_path = recorded_bytes
+        else:
+            recorded_path = _write_temp_audio(recorded_bytes, recorded_ext, "recorded")
+            temp_paths.append(recorded_path)
+
+        logger.info("Starting speech analysis...")
+        return analyze_speech(truth_path, recorded_path, truth_id=truth_id)
+
+    finally:
+        # Clean up temporary files
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def _check_admin_token(token):
+    """Require PROFILE_ADMIN_TOKEN; profiling admin is disabled without one."""
+    import hmac
+
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token, PROFILE_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def record_progress(user_id, phrase_id, result):
+    """Store an attempt for a user; progress failures never fail the analysis."""
+    try:
+        progress_store.record_attempt(user_id, phrase_id, result)
+    except Exception as e:
+        logger.error(f"Failed to record progress for {user_id}: {str(e)}")
+
+
+def run_analysis_job(params, blobs):
+    """Job queue handler for queued analyses."""
+    params = dict(params)
+    user_id = params.pop("user_id", None)
+    phrase_id = params.pop("phrase_id", None)
+
+    result = run_analysis(**params, **blobs)
+    if user_id:
+        record_progress(user_id, phrase_id, result)
+    return result
+
+
+async def _read_analysis_inputs(
+    truth_audio,
+    recorded_audio,
+    truth_audio_base64,
+    recorded_audio_base64,
+    truth_audio_filename,
+    recorded_audio_filename,
+    truth_id,
+):
+    """
+    Validate an analysis submission and read its audio into memory.
+
+    Returns:
+        Dict of run_analysis keyword arguments
+    """
+    # Check if we received base64 data or file uploads
+    use_base64 = recorded_audio_base64 is not None
+    logger.info(f"Using base64 input: {use_base64}")
+
+    has_truth = (
+        truth_audio_base64 is not None if use_base64 else truth_audio is not None
+    )
+    logger.info(f"Truth id: {truth_id}, truth audio provided: {has_truth}")
+    if not has_truth and truth_id is None:
+        raise HTTPException(status_code=400, detail="Provide truth audio or a truth_id")
+    if truth_id is not None and truth_id not in REFERENCE_PHRASES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown truth_id: {truth_id}. "
+            f"Known: {', '.join(REFERENCE_PHRASES)}",
+        )
+    if not use_base64 and recorded_audio is None:
+        raise HTTPException(status_code=400, detail="Recorded audio is required")
+
+    # Validate file types
+    allowed_extensions = {".wav", ".mp3", ".m4a", ".flac", ".ogg", CONTAINER_EXTENSION}
+
+    if use_base64:
+        truth_ext = os.path.splitext(truth_audio_filename)[1].lower()
+        recorded_ext = os.path.splitext(recorded_audio_filename)[1].lower()
+    else:
+        truth_ext = (
+            os.path.splitext(truth_audio.filename)[1].lower() if has_truth else ".mp3"
+        )
+        recorded_ext = os.path.splitext(recorded_audio.filename)[1].lower()
+
+    logger.info(f"Truth file extension: {truth_ext}")
+    logger.info(f"Recorded file extension: {recorded_ext}")
+
+    if truth_ext not in allowed_extensions or recorded_ext not in allowed_extensions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file format. Allowed: {', '.join(allowed_extensions)}",
+        )
+
+    # Read the payloads into memory
+    truth_bytes = None
+    if use_base64:
+        import base64
+
+        if has_truth:
+            truth_bytes = base64.b64decode(truth_audio_base64)
+        recorded_bytes = base64.b64decode(recorded_audio_base64)
+    else:
+        if has_truth:
+            truth_bytes = await truth_audio.read()
+        recorded_bytes = await recorded_audio.read()
+
+    logger.info(f"Truth audio bytes: {len(truth_bytes) if truth_bytes else 0}")
+    logger.info(f"Recorded audio bytes: {len(recorded_bytes)}")
+
+    if truth_bytes is not None and len(truth_bytes) == 0:
+        raise HTTPException(status_code=400, detail="Truth audio is empty")
+    if len(recorded_bytes) == 0:
+        raise HTTPException(status_code=400, detail="Recorded audio is empty")
+
+    # Reject malformed containers before they reach the model
+    for label, ext, data in (
+        ("Truth", truth_ext, truth_bytes),
+        ("Recorded", recorded_ext, recorded_bytes),
+    ):
+        if ext == CONTAINER_EXTENSION and data is not None:
+            try:
+                validate_container(data)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"{label} audio: {str(e)}")
+
+    return {
+        "recorded_bytes": recorded_bytes,
+        "recorded_ext": recorded_ext,
+        "truth_bytes": truth_bytes,
+        "truth_ext": truth_ext if has_truth else None,
+        "truth_id": truth_id,
+    }
+
+
 @app.post("/analyze")
 async def analyze_audio(
+    response: Response,
     truth_audio: UploadFile = File(None, description="Ground truth audio file"),
     recorded_audio: UploadFile = File(
         None, description="Recorded audio file to analyze"
@@ -96,184 +398,99 @@ async def analyze_audio(
     recorded_audio_filename: str = Form(
         "recorded_audio.m4a", description="Recorded audio filename"
     ),
+    truth_id: str = Form(
+        None, description="Precomputed reference phrase ID (replaces truth audio)"
+    ),
+    user_id: str = Form(None, description="User to record this attempt for"),
+    phrase_id: str = Form(
+        None, description="Phrase practised, for progress (default: truth_id)"
+    ),
+    idempotency_key: Optional[str] = Header(None),
+    x_debug_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
 ):
     """
     Analyze two audio files and return transcriptions
 
     - **truth_audio**: The reference/correct pronunciation audio file
     - **recorded_audio**: The user's recorded audio file to analyze
+    - **truth_id**: ID of a precomputed reference phrase; when given, the
+      truth audio may be omitted
+    - **user_id**: Optional user; the attempt is added to their `/progress`
+    - **Idempotency-Key** (header): Optional key identifying a retried request
+    - **X-Debug-Profile** (header): `1` to profile this request; it then
+      bypasses the result cache. Needs `X-Admin-Token` and only works when
+      PROFILE_ADMIN_TOKEN is set
+
+    Identical submissions are answered from a result cache; the
+    `X-Cache` response header reports `hit`, `wait`, `miss` or `bypass`.
+    When a profile is saved its ID is returned in `X-Profile-Id`.
 
     Returns JSON with transcriptions for both files
     """
-    truth_path = None
-    recorded_path = None
-
     try:
         logger.info("=== ANALYSIS REQUEST RECEIVED ===")
 
-        # Check if we received base64 data or file uploads
-        use_base64 = (
-            truth_audio_base64 is not None and recorded_audio_base64 is not None
+        inputs = await _read_analysis_inputs(
+            truth_audio,
+            recorded_audio,
+            truth_audio_base64,
+            recorded_audio_base64,
+            truth_audio_filename,
+            recorded_audio_filename,
+            truth_id,
         )
-        logger.info(f"Using base64 input: {use_base64}")
-
-        if use_base64:
-            logger.info(f"Truth audio base64 length: {len(truth_audio_base64)}")
-            logger.info(f"Recorded audio base64 length: {len(recorded_audio_base64)}")
-            logger.info(f"Truth filename: {truth_audio_filename}")
-            logger.info(f"Recorded filename: {recorded_audio_filename}")
-        else:
-            logger.info(f"Truth audio filename: {truth_audio.filename}")
-            logger.info(f"Recorded audio filename: {recorded_audio.filename}")
-            logger.info(f"Truth audio content_type: {truth_audio.content_type}")
-            logger.info(f"Recorded audio content_type: {recorded_audio.content_type}")
-
-        # Validate file types
-        allowed_extensions = {".wav", ".mp3", ".m4a", ".flac", ".ogg"}
 
-        if use_base64:
-            truth_ext = os.path.splitext(truth_audio_filename)[1].lower()
-            recorded_ext = os.path.splitext(recorded_audio_filename)[1].lower()
-        else:
-            truth_ext = os.path.splitext(truth_audio.filename)[1].lower()
-            recorded_ext = os.path.splitext(recorded_audio.filename)[1].lower()
-
-        logger.info(f"Truth file extension: {truth_ext}")
-        logger.info(f"Recorded file extension: {recorded_ext}")
-
-        if (
-            truth_ext not in allowed_extensions
-            or recorded_ext not in allowed_extensions
-        ):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file format. Allowed: {', '.join(allowed_extensions)}",
+        cache_key = make_cache_key(
+            inputs["recorded_bytes"],
+            truth_bytes=inputs["truth_bytes"],
+            truth_id=truth_id,
+            options={
+                "pipeline_version": PIPELINE_VERSION,
+                "truth_ext": inputs["truth_ext"],
+                "recorded_ext": inputs["recorded_ext"],
+            },
+        )
+        if idempotency_key:
+            try:
+                result_cache.resolve_idempotency_key(idempotency_key, cache_key)
+            except IdempotencyConflict as e:
+                raise HTTPException(status_code=422, detail=str(e))
+
+        # The debug header is ignored unless an admin token is configured
+        debug_profile = x_debug_profile == "1" and bool(PROFILE_ADMIN_TOKEN)
+        if debug_profile:
+            _check_admin_token(x_admin_token)
+
+        profile_ids = []
+
+        async def compute():
+            result, profile_id = await run_in_threadpool(
+                profiler.run, partial(run_analysis, **inputs), force=debug_profile
             )
+            if profile_id:
+                profile_ids.append(profile_id)
+            return result
 
-        # Save uploaded files to temporary locations
-        if use_base64:
-            # Decode base64 data
-            import base64
-
-            logger.info("=== DECODING BASE64 TRUTH AUDIO ===")
-            truth_bytes = base64.b64decode(truth_audio_base64)
-            logger.info(f"Truth audio bytes decoded: {len(truth_bytes)} bytes")
-            logger.info(f"Truth audio first 20 bytes: {truth_bytes[:20]}")
-
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=truth_ext
-            ) as truth_tmp:
-                truth_path = truth_tmp.name
-                logger.info(f"Writing {len(truth_bytes)} bytes to: {truth_path}")
-                bytes_written = truth_tmp.write(truth_bytes)
-                logger.info(f"Bytes written to truth file: {bytes_written}")
-                truth_tmp.flush()
-                logger.info(f"File flushed to disk")
-
-            logger.info("=== DECODING BASE64 RECORDED AUDIO ===")
-            recorded_bytes = base64.b64decode(recorded_audio_base64)
-            logger.info(f"Recorded audio bytes decoded: {len(recorded_bytes)} bytes")
-            logger.info(f"Recorded audio first 20 bytes: {recorded_bytes[:20]}")
-
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=recorded_ext
-            ) as recorded_tmp:
-                recorded_path = recorded_tmp.name
-                logger.info(f"Writing {len(recorded_bytes)} bytes to: {recorded_path}")
-                bytes_written = recorded_tmp.write(recorded_bytes)
-                logger.info(f"Bytes written to recorded file: {bytes_written}")
-                recorded_tmp.flush()
-                logger.info(f"File flushed to disk")
+        if debug_profile:
+            result, cache_status = await compute(), "bypass"
         else:
-            # Read from uploaded files
-            logger.info("=== READING TRUTH AUDIO ===")
-            truth_bytes = await truth_audio.read()
-            logger.info(f"Truth audio bytes read: {len(truth_bytes)} bytes")
-            logger.info(f"Truth audio first 20 bytes: {truth_bytes[:20]}")
-
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=truth_ext
-            ) as truth_tmp:
-                truth_path = truth_tmp.name
-                logger.info(f"Writing {len(truth_bytes)} bytes to: {truth_path}")
-                bytes_written = truth_tmp.write(truth_bytes)
-                logger.info(f"Bytes written to truth file: {bytes_written}")
-                truth_tmp.flush()
-                logger.info(f"File flushed to disk")
-
-            logger.info("=== READING RECORDED AUDIO ===")
-            recorded_bytes = await recorded_audio.read()
-            logger.info(f"Recorded audio bytes read: {len(recorded_bytes)} bytes")
-            logger.info(f"Recorded audio first 20 bytes: {recorded_bytes[:20]}")
-
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=recorded_ext
-            ) as recorded_tmp:
-                recorded_path = recorded_tmp.name
-                logger.info(f"Writing {len(recorded_bytes)} bytes to: {recorded_path}")
-                bytes_written = recorded_tmp.write(recorded_bytes)
-                logger.info(f"Bytes written to recorded file: {bytes_written}")
-                recorded_tmp.flush()
-                logger.info(f"File flushed to disk")
-
-        # Verify files exist and have content
-        logger.info("=== VERIFYING FILES ON DISK ===")
-        logger.info(f"Checking if truth file exists: {truth_path}")
-        if not os.path.exists(truth_path):
-            raise Exception(f"Truth file not created: {truth_path}")
-        logger.info(f"✓ Truth file exists")
-
-        logger.info(f"Checking if recorded file exists: {recorded_path}")
-        if not os.path.exists(recorded_path):
-            raise Exception(f"Recorded file not created: {recorded_path}")
-        logger.info(f"✓ Recorded file exists")
-
-        truth_size = os.path.getsize(truth_path)
-        recorded_size = os.path.getsize(recorded_path)
-        logger.info(f"Truth file size on disk: {truth_size} bytes")
-        logger.info(f"Recorded file size on disk: {recorded_size} bytes")
-
-        if truth_size == 0:
-            raise Exception(f"Truth audio file is empty: {truth_path}")
-        if recorded_size == 0:
-            raise Exception(f"Recorded audio file is empty: {recorded_path}")
-
-        # Convert m4a to wav if needed (for better compatibility with librosa)
-        if recorded_ext == ".m4a":
-            logger.info("Converting m4a to wav...")
-            from pydub import AudioSegment
-
-            # Load m4a and convert to wav
-            audio = AudioSegment.from_file(recorded_path, format="m4a")
-            new_recorded_path = recorded_path.replace(".m4a", ".wav")
-            audio.export(new_recorded_path, format="wav")
-
-            # Clean up old m4a file
-            os.unlink(recorded_path)
-            recorded_path = new_recorded_path
-            logger.info(f"Converted to wav: {recorded_path}")
-
-        if truth_ext == ".m4a":
-            logger.info("Converting truth m4a to wav...")
-            from pydub import AudioSegment
-
-            # Load m4a and convert to wav
-            audio = AudioSegment.from_file(truth_path, format="m4a")
-            new_truth_path = truth_path.replace(".m4a", ".wav")
-            audio.export(new_truth_path, format="wav")
-
-            # Clean up old m4a file
-            os.unlink(truth_path)
-            truth_path = new_truth_path
-            logger.info(f"Converted truth to wav: {truth_path}")
+            result, cache_status = await result_cache.get_or_compute(cache_key, compute)
+        logger.info(f"=== ANALYSIS SUCCESS (cache {cache_status}) ===")
 
-        # Run analysis
-        logger.info("Starting speech analysis...")
-        result = analyze_speech(truth_path, recorded_path)
-        logger.info("=== ANALYSIS SUCCESS ===")
+        # Cached results are retries of an attempt that was already recorded
+        if user_id and cache_status in ("miss", "bypass"):
+            await run_in_threadpool(
+                record_progress, user_id, phrase_id or truth_id or "custom", result
+            )
 
+        response.headers["X-Cache"] = cache_status
+        if profile_ids:
+            response.headers["X-Profile-Id"] = profile_ids[0]
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("=== ANALYSIS FAILED ===")
         logger.error(f"Error type: {type(e).__name__}")
@@ -283,12 +500,158 @@ async def analyze_audio(
         logger.error(f"Traceback:\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-    finally:
-        # Clean up temporary files
-        if truth_path and os.path.exists(truth_path):
-            os.unlink(truth_path)
-        if recorded_path and os.path.exists(recorded_path):
-            os.unlink(recorded_path)
+
+@app.post("/analyze/jobs", status_code=202)
+async def create_analysis_job(
+    truth_audio: UploadFile = File(None, description="Ground truth audio file"),
+    recorded_audio: UploadFile = File(
+        None, description="Recorded audio file to analyze"
+    ),
+    truth_audio_base64: str = Form(None, description="Ground truth audio as base64"),
+    recorded_audio_base64: str = Form(None, description="Recorded audio as base64"),
+    truth_audio_filename: str = Form(
+        "truth_audio.mp3", description="Truth audio filename"
+    ),
+    recorded_audio_filename: str = Form(
+        "recorded_audio.m4a", description="Recorded audio filename"
+    ),
+    truth_id: str = Form(
+        None, description="Precomputed reference phrase ID (replaces truth audio)"
+    ),
+    user_id: str = Form(None, description="User to record this attempt for"),
+    phrase_id: str = Form(
+        None, description="Phrase practised, for progress (default: truth_id)"
+    ),
+    priority: int = Form(0, description="Higher priority jobs run first"),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Queue an analysis and return immediately.
+
+    Accepts the same inputs as `/analyze`. Poll `GET /analyze/jobs/{job_id}`
+    for the status and result.
+
+    A retried submission (same `Idempotency-Key`, or identical audio and
+    options) returns the existing job while it is queued, running or
+    recently done, with `"duplicate": true`.
+    """
+    inputs = await _read_analysis_inputs(
+        truth_audio,
+        recorded_audio,
+        truth_audio_base64,
+        recorded_audio_base64,
+        truth_audio_filename,
+        recorded_audio_filename,
+        truth_id,
+    )
+
+    if user_id:
+        inputs["user_id"] = user_id
+        inputs["phrase_id"] = phrase_id or truth_id or "custom"
+
+    blobs = {"recorded_bytes": inputs.pop("recorded_bytes")}
+    truth_bytes = inputs.pop("truth_bytes")
+    if truth_bytes is not None:
+        blobs["truth_bytes"] = truth_bytes
+
+    dedup_key = make_cache_key(
+        blobs["recorded_bytes"],
+        truth_bytes=truth_bytes,
+        truth_id=truth_id,
+        options={
+            "pipeline_version": PIPELINE_VERSION,
+            "truth_ext": inputs["truth_ext"],
+            "recorded_ext": inputs["recorded_ext"],
+            "user_id": inputs.get("user_id"),
+            "phrase_id": inputs.get("phrase_id"),
+        },
+    )
+
+    try:
+        job_id, created = await run_in_threadpool(
+            job_queue.submit,
+            "analyze",
+            inputs,
+            blobs,
+            priority,
+            dedup_key=dedup_key,
+            idempotency_key=idempotency_key,
+        )
+    except JobConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if created:
+        logger.info(f"Queued analysis job {job_id} (priority {priority})")
+        return {"job_id": job_id, "status": "queued", "duplicate": False}
+
+    logger.info(f"Duplicate submission of analysis job {job_id}")
+    job = await run_in_threadpool(job_queue.get, job_id)
+    return {"job_id": job_id, "status": job["status"], "duplicate": True}
+
+
+@app.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """
+    Get the status of an analysis job.
+
+    Status is one of `queued`, `running`, `done` or `failed`; `result`
+    holds the `/analyze` response once the job is done.
+    """
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.get("/progress/{user_id}")
+async def get_progress(user_id: str):
+    """
+    Get a user's progress across analysed attempts.
+
+    Returns cumulative lisp counts, rolling lisp-type rates (per /s/ scored)
+    and per-phrase first/last/best/rolling rates with improvement.
+    """
+    progress = await run_in_threadpool(progress_store.get_progress, user_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"No attempts for user: {user_id}")
+    return progress
+
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """
+    List the most recent /analyze profiles, newest first.
+
+    Profiles are captured for runs slower than PROFILE_THRESHOLD_MS and for
+    requests sent with `X-Debug-Profile: 1`.
+    """
+    _check_admin_token(x_admin_token)
+    return {
+        "threshold_ms": profiler.threshold_ms,
+        "profiles": await run_in_threadpool(profiler.list_profiles),
+    }
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Return a profile's metadata, including torch operator timings."""
+    _check_admin_token(x_admin_token)
+    metadata = profiler.get_metadata(profile_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return metadata
+
+
+@app.get("/admin/profiles/{profile_id}/folded")
+async def get_profile_stacks(
+    profile_id: str, x_admin_token: Optional[str] = Header(None)
+):
+    """Return a profile's sampled stacks in folded format for flamegraph tools."""
+    _check_admin_token(x_admin_token)
+    path = profiler.folded_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
 
 
 @app.post("/tts/generate")
@@ -303,17 +666,31 @@ async def generate_tts(
     """
     Generate text-to-speech audio using ElevenLabs.
 
+    Prompts pre-rendered for a new voice clone are served from disk.
+
     Returns MP3 audio file.
     """
+    if not is_valid_voice_id(voice_id):
+        raise HTTPException(status_code=400, detail=f"Invalid voice ID: {voice_id}")
+
     try:
-        audio_bytes = tts(
-            text=text,
-            voice_id=voice_id,
-            speed=speed,
-            stability=stability,
-            similarity_boost=similarity_boost,
-            style=style,
+        cache_path = tts_cache_path(
+            text, voice_id, speed, stability, similarity_boost, style
         )
+        if os.path.exists(cache_path):
+            logger.info(f"Serving pre-rendered TTS: {cache_path}")
+            with open(cache_path, "rb") as f:
+                audio_bytes = f.read()
+        else:
+            audio_bytes = await run_in_threadpool(
+                tts,
+                text=text,
+                voice_id=voice_id,
+                speed=speed,
+                stability=stability,
+                similarity_boost=similarity_boost,
+                style=style,
+            )
 
         return Response(
             content=audio_bytes,
@@ -374,15 +751,23 @@ async def stitch_audio_files(
 
 @app.post("/tts/clone")
 async def create_voice_clone(
+    background_tasks: BackgroundTasks,
     audio_file: UploadFile = File(..., description="Audio sample for voice cloning"),
     name: str = Form("userClone", description="Name for the cloned voice"),
     description: str = Form(
         "User's custom voice clone", description="Description of the voice"
     ),
+    user_id: str = Form(
+        None, description="Owner; re-recorded samples from them reuse their clone"
+    ),
 ):
     """
     Create a voice clone from an audio sample.
 
+    A sample already cloned (same bytes, or for the same user a matching
+    acoustic fingerprint) returns the existing voice ID. New clones get the
+    mission prompts pre-rendered in the background.
+
     Returns the voice ID and details.
     """
     try:
@@ -398,19 +783,45 @@ async def create_voice_clone(
             f"Received audio file: {audio_file.filename}, size: {len(audio_bytes)} bytes"
         )
         
-        # Create voice clone
-        voice = generate_clone(audio_bytes, name=name, description=description)
+        def create(sample_bytes):
+            voice = generate_clone(sample_bytes, name=name, description=description)
+
+            if not voice or not hasattr(voice, "voice_id"):
+                raise HTTPException(
+                    status_code=500,
+                    detail="Voice clone created but no voice_id returned",
+                )
+            if not is_valid_voice_id(voice.voice_id):
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Voice clone returned an invalid voice_id: {voice.voice_id}",
+                )
+            return voice.voice_id
+
+        # Reuse an existing clone or create a new one
+        voice_id, created = await run_in_threadpool(
+            clone_registry.get_or_create,
+            audio_bytes,
+            create,
+            user_id=user_id,
+            name=name,
+        )
 
-        if not voice or not hasattr(voice, "voice_id"):
-            raise HTTPException(
-                status_code=500, detail="Voice clone created but no voice_id returned"
-            )
+        if created:
+            background_tasks.add_task(prerender_tts, MISSION_PROMPTS, voice_id)
+        else:
+            logger.info(f"Reusing existing voice clone: {voice_id}")
 
         return {
-            "voice_id": voice.voice_id,
+            "voice_id": voice_id,
             "name": name,
             "description": description,
-            "status": "Voice clone created successfully",
+            "reused": not created,
+            "status": (
+                "Voice clone created successfully"
+                if created
+                else "Existing voice clone reused"
+            ),
         }
     except HTTPException:
         raise
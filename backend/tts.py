@@ -7,6 +7,7 @@ Provides ElevenLabs TTS capabilities including generation, stitching, and voice
 from elevenlabs.client import ElevenLabs
 from pydub import AudioSegment
 import os
+import re
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -55,6 +56,71 @@ def tts(
     return audio_bytes
 
 
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "tts_cache")
+)
+
+# ElevenLabs voice IDs are alphanumeric; anything else could escape the cache
+_VOICE_ID = re.compile(r"[A-Za-z0-9]+")
+
+
+def is_valid_voice_id(voice_id):
+    """Return True if voice_id is safe to use as a cache path component."""
+    return isinstance(voice_id, str) and bool(_VOICE_ID.fullmatch(voice_id))
+
+
+def tts_cache_path(
+    text,
+    voice_id="56AoDkrOh6qfVPDXZ7Pt",
+    speed=0.8,
+    stability=0.95,
+    similarity_boost=0.75,
+    style=0.0,
+):
+    """
+    Path of the pre-rendered MP3 for a TTS request (it may not exist).
+
+    Returns:
+        str: File path keyed by a hash of the text, voice and settings
+
+    Raises:
+        ValueError: If voice_id is not alphanumeric
+    """
+    import hashlib
+
+    if not is_valid_voice_id(voice_id):
+        raise ValueError(f"Invalid voice ID: {voice_id!r}")
+
+    key = repr((text, voice_id, speed, stability, similarity_boost, style))
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, voice_id, f"{digest}.mp3")
+
+
+def prerender_tts(texts, voice_id):
+    """
+    Render texts with the default voice settings into the TTS cache.
+
+    Args:
+        texts: Texts to render
+        voice_id: ElevenLabs voice ID
+    """
+    for text in texts:
+        path = tts_cache_path(text, voice_id=voice_id)
+        if os.path.exists(path):
+            continue
+        try:
+            audio_bytes = tts(text, voice_id=voice_id)
+        except Exception as e:
+            print(f"[prerender_tts] Failed to render for {voice_id}: {str(e)}")
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        with open(path + ".tmp", "wb") as f:
+            f.write(audio_bytes)
+        os.replace(path + ".tmp", path)
+
+
 def stitch_audios(audio_list, pause_duration=500):
     """
     Stitch multiple audio files together with pauses in between.
@@ -117,52 +183,18 @@ def generate_clone(
     Returns:
         Voice object with voice_id attribute
     """
-    import tempfile
-    import os
-    from io import BytesIO
-
-    temp_path = None
-    audio_file = None
     try:
         # Validate audio bytes
         if not audio_bytes or len(audio_bytes) == 0:
             raise ValueError("Audio bytes are empty")
-        
-        # Create temporary file with .mp3 extension
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".mp3", mode="wb"
-        ) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_file.flush()  # Ensure data is written to disk
-            os.fsync(temp_file.fileno())  # Force write to disk
-            temp_path = temp_file.name
-
-        # Verify file exists and has content
-        if not os.path.exists(temp_path):
-            raise FileNotFoundError(f"Temp file not found: {temp_path}")
-        
-        file_size = os.path.getsize(temp_path)
-        if file_size == 0:
-            raise ValueError(f"Temp file is empty: {temp_path}")
-        
-        # Open file and keep it open during API call
-        # Use binary mode and ensure it stays open
-        audio_file = open(temp_path, "rb")
-        
-        # Make sure file is readable
-        audio_file.seek(0)
-        
-        # Create voice clone - file handle must stay open during this call
+
+        # Upload the bytes directly as a named multipart file
         voice = client.voices.ivc.create(
             name=name,
-            files=[audio_file],
+            files=[("sample.mp3", audio_bytes, "audio/mpeg")],
             description=description,
             remove_background_noise=False,  # Disabled to allow shorter recordings (min 4.6s required when enabled)
         )
-        
-        # Close file after API call completes
-        audio_file.close()
-        audio_file = None
 
         return voice
 
@@ -173,18 +205,3 @@ def generate_clone(
         print(f"[generate_clone] Traceback:")
         traceback.print_exc()
         raise
-    finally:
-        # Close file handle if still open
-        if audio_file:
-            try:
-                audio_file.close()
-            except Exception:
-                pass
-        
-        # Clean up temp file
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-                print(f"[generate_clone] Temp file cleaned up: {temp_path}")
-            except Exception as cleanup_error:
-                print(f"[generate_clone] Cleanup error: {cleanup_error}")